@@ -0,0 +1,45 @@
+'''MatStruct key bookkeeping: inserting and deleting fields and dir() (tab completion)
+
+The time per inserted or deleted field should stay constant as the number of
+fields grows. Repeated dir() calls on an unchanged struct should cost about
+the same as a single pass over the names.
+
+Usage: python benchmarks/bench_matstruct.py
+'''
+
+import random
+import timeit
+from pydons import MatStruct
+
+
+def insert_delete_time(n):
+    keys = ['field%d' % i for i in range(n)]
+    # fields are deleted in a random order
+    deleted = keys[:]
+    random.Random(0).shuffle(deleted)
+
+    def run():
+        d = MatStruct()
+        for key in keys:
+            d[key] = None
+        # completion list in use while the struct changes
+        dir(d)
+        for key in deleted:
+            del d[key]
+    return min(timeit.repeat(run, number=1, repeat=3))
+
+
+def dir_time(n, calls=10):
+    d = MatStruct(('field%d' % i, None) for i in range(n))
+    return min(timeit.repeat(lambda: dir(d), number=calls, repeat=3)) / calls
+
+
+def main():
+    print('%8s %14s %14s' % ('fields', 'us / field', 'dir() [ms]'))
+    for n in (1000, 4000, 16000, 64000):
+        t = insert_delete_time(n)
+        print('%8d %14.2f %14.2f' % (n, t / n * 1e6, dir_time(n) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''FileBrowser scan time as a function of the number of nodes
+
+The time per node should stay constant (linear scan time) for both wide
+(many children per group) and deep (nested groups) files.
+
+Usage: python benchmarks/bench_scan.py
+'''
+
+import os
+import tempfile
+import timeit
+import h5py
+import numpy as np
+from pydons import FileBrowser, LazyDataset
+
+
+def make_file(file_name, ngroups, nvars):
+    with h5py.File(file_name, 'w') as fh:
+        for i in range(ngroups):
+            grp = fh.create_group('group%d' % i)
+            for j in range(nvars):
+                grp.create_dataset('var%d' % j, data=np.zeros(16))
+
+
+def scan_time(file_name, repeat=3):
+    def scan():
+        LazyDataset.close_files()
+        FileBrowser(file_name, lazy_min_size=0)
+    return min(timeit.repeat(scan, number=1, repeat=repeat))
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    print('%8s %8s %8s %10s %12s' % ('groups', 'vars', 'nodes', 'time [s]', 'us / node'))
+    for ngroups, nvars in ((1, 1000), (1, 2000), (1, 4000), (1, 8000),
+                           (100, 10), (200, 10), (400, 10), (800, 10)):
+        file_name = os.path.join(tmpdir, 'scan_%d_%d.h5' % (ngroups, nvars))
+        make_file(file_name, ngroups, nvars)
+        nodes = ngroups * (nvars + 1)
+        t = scan_time(file_name)
+        print('%8d %8d %8d %10.3f %12.1f' % (ngroups, nvars, nodes, t, 1e6 * t / nodes))
+        os.remove(file_name)
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,9 +16,17 @@ try:
     del _collectionsModule
 except NameError:
     raise ImportError('No OrderedDict module found')
-from collections import deque
+import bisect
 import numbers
 import pydons.hdf5util
+import pydons.selection
+import pydons.cache
+import pydons.filepool
+import pydons.instrument
+import pydons.metaindex
+import threading
+import timeit
+import zlib
 import hdf5storage
 import numpy as np
 import posixpath
@@ -28,10 +36,21 @@ try:
 except ImportError:
     NETCDF4 = False
 import h5py
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    # Python 2 without the futures package, everything runs in a single thread
+    ThreadPoolExecutor = ProcessPoolExecutor = None
+import atexit
+import fnmatch
+import glob
+import multiprocessing
 import os
+import re
 import sys
-import weakref
 import six
+from six.moves import cPickle as pickle
+import weakref
 
 
 class MatStruct(_OrderedDict):
@@ -49,21 +68,32 @@ class MatStruct(_OrderedDict):
     :param any_keys: allow arbitrary keys, not only strings
     """
 
-    __FORBIDDEN_KEYS = tuple(dir(_OrderedDict) +
-                             ['insert_after', 'insert_before',
-                              'diff', 'merge', 'saveh5', 'loadh5',
-                              'savemat', 'loadmat'])
+    __FORBIDDEN_KEYS = frozenset(dir(_OrderedDict) +
+                                 ['insert_after', 'insert_before',
+                                  'diff', 'merge', 'saveh5', 'loadh5',
+                                  'savemat', 'loadmat', 'from_items'])
     __MC = None
 
     @classmethod
     def __mc(cls):
         if cls.__MC is None:
-            cls.__MC = hdf5storage.MarshallerCollection([pydons.hdf5util.MatStructMarshaller(cls)])
+            cls.__MC = hdf5storage.MarshallerCollection(
+                [pydons.hdf5util.MatStructMarshaller(cls, MatStructArray),
+                 pydons.hdf5util.MatStructArrayMarshaller(MatStructArray)])
         return cls.__MC
 
     @classmethod
     def __is_valid_key(cls, key):
         '''Check if key is valid'''
+        if isinstance(key, six.string_types):
+            if key in _VALID_KEYS:
+                return True
+            if _KEY_RE.match(key) and key not in cls.__FORBIDDEN_KEYS:
+                if len(_VALID_KEYS) >= _MAX_VALID_KEYS:
+                    _VALID_KEYS.clear()
+                _VALID_KEYS.add(key)
+                return True
+        # the detailed checks give the reason
         if not isinstance(key, six.string_types):
             raise KeyError('Keys can be only strings')
         if not key:
@@ -87,15 +117,59 @@ class MatStruct(_OrderedDict):
         # hiding attributes via __dir__ does not seem to work in ipython
         # self._hide_methods = kwargs.pop('hide_methods', False)
         # hiding attributes via __dir__ does not seem to work in ipython
-        self._any_keys = any_keys
-        self._item_dir = []
-        # TODO any_keys not taken into account in the OrderedDict constructor
-        super(MatStruct, self).__init__(values)
-        # convert dict objects to MatStruct
-        if dedict:
-            for key, value in self.items():
-                if isinstance(value, dict):
-                    self[key] = self.__class__(value, dedict=dedict, any_keys=any_keys)
+        self.__setup(any_keys)
+        self.__fill(values, dedict, 'fast')
+
+    def __setup(self, any_keys):
+        super(MatStruct, self).__init__()
+        # keys accessible as attributes (_item_dir), their sorted list (_sorted_dir)
+        # is maintained once __dir__ is used
+        self.__dict__.update(_any_keys=any_keys, _item_dir=set(), _sorted_dir=None)
+
+    @classmethod
+    def from_items(cls, values, dedict=True, any_keys=False, validate='fast'):
+        '''Create a MatStruct from many items at once
+
+        Nested dict objects are converted in the same pass.
+
+        :param values: list/tuple of key, value pairs or a dict-like object
+        :param dedict: convert dict members to MatStruct
+        :param any_keys: allow arbitrary keys, not only strings
+        :param validate: 'fast' checks the keys like item assignment does,
+            'none' skips the check for trusted keys (e.g. read from a MatStruct file)
+        '''
+        if validate not in ('fast', 'none'):
+            raise ValueError('validate must be "fast" or "none"')
+        res = cls.__new__(cls)
+        res.__setup(any_keys)
+        res.__fill(values, dedict, validate)
+        return res
+
+    def __fill(self, values, dedict, validate):
+        '''Insert items of an empty MatStruct in a single pass
+        '''
+        if isinstance(values, dict):
+            values = values.items()
+        elif hasattr(values, 'keys'):
+            values = ((key, values[key]) for key in values.keys())
+        item_dir = self._item_dir
+        setitem = _OrderedDict.__setitem__
+        for key, value in values:
+            if dedict and isinstance(value, dict):
+                # convert dict objects to MatStruct
+                value = self.__class__.from_items(value, dedict, self._any_keys, validate)
+            if validate == 'none':
+                if isinstance(key, six.string_types):
+                    item_dir.add(key)
+            elif key not in item_dir:
+                try:
+                    self.__is_valid_key(key)
+                except KeyError:
+                    if not self._any_keys:
+                        raise
+                else:
+                    item_dir.add(key)
+            setitem(self, key, value)
 
     def __getattr__(self, item):
         if item in self:
@@ -111,14 +185,45 @@ class MatStruct(_OrderedDict):
                 if not self._any_keys:
                     raise
             else:
-                self._item_dir.append(item)
+                self._item_dir.add(item)
+                if self._sorted_dir is not None:
+                    bisect.insort(self._sorted_dir, item)
         super(MatStruct, self).__setitem__(item, value)
 
     def __delitem__(self, item):
         super(MatStruct, self).__delitem__(item)
-        # TODO this migth not be optimum
+        self.__forget(item)
+
+    def __forget(self, item):
+        '''Remove a deleted key from the attribute names
+        '''
         if item in self._item_dir:
             self._item_dir.remove(item)
+            if self._sorted_dir is not None:
+                del self._sorted_dir[bisect.bisect_left(self._sorted_dir, item)]
+
+    # OrderedDict methods that do not call __delitem__
+    def pop(self, item, *default):
+        if item in self:
+            self.__forget(item)
+        return super(MatStruct, self).pop(item, *default)
+
+    def popitem(self, last=True):
+        item, value = super(MatStruct, self).popitem(last=last)
+        self.__forget(item)
+        return item, value
+
+    def clear(self):
+        super(MatStruct, self).clear()
+        self._item_dir.clear()
+        self._sorted_dir = None
+
+    def __reduce__(self):
+        # the attribute names are rebuilt by __setitem__, copies must not share them
+        reduced = super(MatStruct, self).__reduce__()
+        state = dict((key, value) for key, value in (reduced[2] or {}).items()
+                     if key not in ('_item_dir', '_sorted_dir'))
+        return (reduced[0], reduced[1], state or None) + tuple(reduced[3:])
 
     def __setattr__(self, item, value):
         if item.startswith('_'):
@@ -163,10 +268,12 @@ class MatStruct(_OrderedDict):
         self.__insertion(self._OrderedDict__map[existing_key][0], key, value)
 
     def __dir__(self):
-        d = self._item_dir[:]
+        if self._sorted_dir is None:
+            self._sorted_dir = sorted(self._item_dir)
         # if not self._hide_methods:
-        d += dir(self.__class__)
+        d = self._sorted_dir + _class_dir(self.__class__)
         d += self.__dict__.keys()
+        # sorting concatenated sorted runs is fast, dir() sorts the (sorted) result again
         d.sort()
         return d
 
@@ -199,16 +306,33 @@ class MatStruct(_OrderedDict):
         diff_max = maximum of norm differences,
         diff_uncomparable = number of uncomparable fields.
 
+        Arrays and LazyDataset fields are compared in blocks along the first axis,
+        the norms of the difference and of the field value are computed in the same
+        pass and data sets are not loaded into the memory as a whole.
+
         :param other: MatStruct object to compare to
 
         Keyword arguments
 
-        :param norm: norm function, default is numpy.linalg.norm
+        :param norm: norm function, default is the 2-norm (Frobenius for matrices) computed
+            in blocks; any other function is applied to the whole arrays
         :param rel_norm_thold: relative difference threshold above which relative difference is normalized by the norm of the field value
+        :param nan: NaN handling, 'propagate' (NaN results), 'equal' (NaN's at the same
+            positions are equal, NaN in one of the values only gives an infinite
+            difference) or 'ignore' (positions with NaN in either value are skipped);
+            masked values (e.g. netCDF4 fill values) are equal if masked in both and
+            give an infinite difference if masked in one of them only
+        :param tol: stop comparing a field once the norm of its difference exceeds tol,
+            the difference is then infinite
+        :param max_workers: number of threads comparing blocks concurrently
+        :param block_nbytes: target size of the compared blocks in bytes
         '''
 
-        norm = kwargs.get('norm', np.linalg.norm)
+        norm = kwargs.get('norm')
         rel_norm_thold = kwargs.get('rel_norm_thold', 1e-12)
+        nan = kwargs.get('nan', 'propagate')
+        if nan not in ('propagate', 'equal', 'ignore'):
+            raise ValueError('nan must be "propagate", "equal" or "ignore"')
 
         self_keys = set(self.keys())
         other_keys = set(other.keys())
@@ -219,17 +343,16 @@ class MatStruct(_OrderedDict):
                            "is in the keys of the compared objects")
         res = MatStruct()
         nnorm = 0
-        # TODO take care of nan's
         res['diff_norm'] = 0
         res['diff_max'] = 0
         res['diff_uncomparable'] = 0
         for key in self.keys():
             # common keys
             if key in common_keys:
-                if isinstance(self[key], self.__class__):
+                if isinstance(self[key], dict):
                     if isinstance(other[key], dict):
                         # this allows for standard dict
-                        res[key] = self.diff(other[key])
+                        res[key] = MatStruct.diff(self[key], other[key], **kwargs)
                         res['diff_norm'] += res[key]['diff_norm']
                         res['diff_max'] = max(res['diff_max'], res[key]['diff_norm'])
                         nnorm += 1
@@ -237,14 +360,20 @@ class MatStruct(_OrderedDict):
                         res['diff_uncomparable'] += 1
                         res[key] = ('type(other["%s"]) is %s, not %s' %
                                     (key, type(other[key]), type(self[key])))
-                elif isinstance(self[key], (numbers.Number, np.ndarray, np.generic)):
+                elif isinstance(self[key], (numbers.Number, np.ndarray, np.generic, LazyDataset)):
                     try:
-                        diff = norm(self[key] - other[key])
+                        if norm is None:
+                            diff, self_norm = _diff_norms(self[key], other[key], nan,
+                                                          kwargs.get('tol'),
+                                                          kwargs.get('max_workers', 1),
+                                                          kwargs.get('block_nbytes', 2 ** 23))
+                        else:
+                            diff = norm(np.asanyarray(self[key]) - np.asanyarray(other[key]))
+                            self_norm = norm(np.asanyarray(self[key]))
                     except Exception as e:
                         res['diff_uncomparable'] += 1
                         res[key] = '%s' % e
                     else:
-                        self_norm = norm(self[key])
                         res[key] = diff
                         if self_norm > rel_norm_thold:
                             res[key] /= self_norm
@@ -271,13 +400,31 @@ class MatStruct(_OrderedDict):
         res['diff_norm'] /= nnorm
         return res
 
-    def merge(self, other):
-        '''Merge fields form another MatStruct or any dict-like object
+    def merge(self, *others, **kwargs):
+        '''Merge fields from other MatStruct or any dict-like objects (in place)
 
-        :param other: object to merge from
+        Nested structs are merged recursively. Values are not copied, i.e. the
+        merged struct shares the arrays (and other leaf values) of the inputs;
+        new nested structs are created so that the inputs are not modified.
+
+        :param others: objects to merge from
+        :return: self
+
+        Keyword arguments
+
+        :param conflict: what to do if a field exists in more than one struct:
+            'overwrite' uses the last value, 'keep' the first one, 'raise' raises
+            a KeyError and 'concatenate' concatenates the values along axis
+        :param axis: concatenation axis, scalars are treated as 1-element arrays
         '''
-        # TODO
-        raise NotImplementedError('to be implemented')
+        conflict = kwargs.pop('conflict', 'overwrite')
+        axis = kwargs.pop('axis', 0)
+        if kwargs:
+            raise TypeError('unexpected keyword arguments: %s' % ', '.join(kwargs))
+        if conflict not in ('overwrite', 'keep', 'raise', 'concatenate'):
+            raise ValueError('conflict must be "overwrite", "keep", "raise" or "concatenate"')
+        _merge(self, others, conflict, axis, '')
+        return self
 
     def saveh5(self, file_name, path='/', truncate_existing=False,
                matlab_compatible=False, **kwargs):
@@ -323,6 +470,452 @@ class MatStruct(_OrderedDict):
         return cls(hdf5storage.loadmat(file_name, marshaller_collection=cls.__mc()), **kwargs)
 
 
+# valid keys (attribute names) of MatStruct
+_KEY_RE = re.compile(r'[A-Za-z][A-Za-z0-9_]*\Z')
+# memoised keys that passed the validation, cleared when too large
+_VALID_KEYS = set()
+_MAX_VALID_KEYS = 100000
+
+# sorted dir() of classes
+_CLASS_DIRS = {}
+
+
+def _class_dir(cls):
+    """Sorted dir() of a class, cached
+    """
+    names = _CLASS_DIRS.get(cls)
+    if names is None:
+        names = _CLASS_DIRS[cls] = sorted(dir(cls))
+    return names
+
+
+def _diff_norms(value, other, nan, tol, max_workers, block_nbytes):
+    '''Norms of the difference and of the value computed in blocks along the first axis
+
+    :return: (difference norm, value norm), the difference norm is infinite if it
+        exceeds tol
+    '''
+    lazy = isinstance(value, LazyDataset) or isinstance(other, LazyDataset)
+    shape = np.shape(value)
+    if shape != np.shape(other):
+        if lazy:
+            raise ValueError('shapes %s and %s differ' % (shape, np.shape(other)))
+        # broadcasting in-memory values
+        keys = [None]
+    elif not shape:
+        keys = [None]
+    else:
+        row_nbytes = max(1, int(np.prod(shape[1:])) * np.dtype(value.dtype).itemsize)
+        rows = max(1, block_nbytes // row_nbytes)
+        chunks = getattr(value, '_chunks', None) or getattr(other, '_chunks', None)
+        if chunks is not None:
+            # aligned to the chunks of the first LazyDataset
+            chunk = chunks[(value if getattr(value, '_chunks', None) else other)._axes[0]]
+            rows = max(1, rows // chunk) * chunk
+        keys = [slice(start, min(start + rows, shape[0])) for start in range(0, shape[0], rows)]
+
+    def compare(key):
+        return _diff_sums(_diff_block(value, key), _diff_block(other, key), nan)
+
+    diff2 = norm2 = 0.0
+    if max_workers > 1 and len(keys) > 1 and ThreadPoolExecutor is not None:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(compare, key) for key in keys]
+        results = (future.result() for future in futures)
+    else:
+        executor = None
+        results = (compare(key) for key in keys)
+    try:
+        for block_diff2, block_norm2 in results:
+            diff2 += block_diff2
+            norm2 += block_norm2
+            if diff2 == np.inf or (tol is not None and np.sqrt(diff2) > tol):
+                return np.inf, np.sqrt(norm2)
+    finally:
+        if executor is not None:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+    return np.sqrt(diff2), np.sqrt(norm2)
+
+
+def _diff_block(value, key):
+    '''Read a block (rows of the first axis or everything if key is None)
+
+    :return: (array, mask), the mask is None unless some values are masked
+    '''
+    if key is None:
+        data = np.asanyarray(value)
+    elif isinstance(value, LazyDataset):
+        # bypasses the global cache
+        block = (slice(key.start, key.stop, 1), ) + tuple(slice(0, n, 1) for n in value.shape[1:])
+        data = _read_block(value, block, cache=False)
+    else:
+        data = value[key]
+    mask = None
+    if isinstance(data, np.ma.MaskedArray):
+        mask = np.ma.getmaskarray(data)
+        if not mask.any():
+            mask = None
+        data = np.ma.getdata(data)
+    return np.asarray(data), mask
+
+
+def _diff_sums(value, other, nan):
+    '''Sums of squares of the difference and of the value, given (array, mask) pairs
+
+    Values masked in both are equal, a value masked in one of them only gives an
+    infinite difference, whatever the NaN handling is.
+    '''
+    (value, value_mask), (other, other_mask) = value, other
+    diff = value - other
+    skip = None
+    if value_mask is not None or other_mask is not None:
+        value_mask = False if value_mask is None else value_mask
+        other_mask = False if other_mask is None else other_mask
+        if np.any(value_mask != other_mask):
+            return np.inf, _sum_squares(np.where(value_mask, 0, value))
+        skip = np.broadcast_to(value_mask, diff.shape)
+    if nan != 'propagate' and diff.dtype.kind in 'fc':
+        value_nan = np.isnan(value)
+        other_nan = np.isnan(other)
+        if skip is not None:
+            value_nan = value_nan & ~skip
+            other_nan = other_nan & ~skip
+        if nan == 'equal' and np.any(value_nan != other_nan):
+            return np.inf, _sum_squares(np.where(value_nan, 0, value))
+        skip = value_nan | other_nan if skip is None else skip | value_nan | other_nan
+    if skip is not None and np.any(skip):
+        diff = np.where(skip, 0, diff)
+        value = np.where(skip, 0, np.broadcast_to(value, diff.shape))
+    return _sum_squares(diff), _sum_squares(value)
+
+
+def _sum_squares(data):
+    data = np.asarray(data).ravel()
+    if data.dtype.kind not in 'fc':
+        data = data.astype(float)
+    return float(np.vdot(data, data).real)
+
+
+def _merge(target, sources, conflict, axis, path):
+    '''Merge the sources into the target dict in place, see MatStruct.merge
+    '''
+    keys = _OrderedDict((key, None) for key in target.keys())
+    for source in sources:
+        keys.update((key, None) for key in source.keys())
+    for key in keys:
+        values = [target[key]] if key in target else []
+        values.extend(source[key] for source in sources if key in source)
+        if len(values) == 1 and key in target:
+            continue
+        if all(isinstance(value, dict) for value in values):
+            # merge into a new struct unless it exists in target
+            if key in target:
+                struct, values = values[0], values[1:]
+            else:
+                struct = MatStruct(any_keys=getattr(target, '_any_keys', True))
+            _merge(struct, values, conflict, axis, path + '%s.' % key)
+            target[key] = struct
+            continue
+        if len(values) == 1:
+            value = values[0]
+        elif conflict == 'overwrite':
+            value = values[-1]
+        elif conflict == 'keep':
+            value = values[0]
+        elif conflict == 'raise':
+            raise KeyError('conflicting field "%s%s"' % (path, key))
+        elif any(isinstance(value, dict) for value in values):
+            raise TypeError('cannot concatenate struct field "%s%s"' % (path, key))
+        else:
+            value = _concatenate(values, axis)
+        if isinstance(value, dict) and not (key in target and value is target[key]):
+            # a new struct, later merges must not modify the source
+            struct = MatStruct(any_keys=getattr(target, '_any_keys', True))
+            _merge(struct, [value], conflict, axis, path + '%s.' % key)
+            value = struct
+        target[key] = value
+
+
+def _concatenate(values, axis):
+    '''Concatenate values into a single preallocated array
+    '''
+    arrays = [np.atleast_1d(np.asanyarray(value)) for value in values]
+    if any(isinstance(a, np.ma.MaskedArray) for a in arrays):
+        return np.ma.concatenate(arrays, axis)
+    shape = list(arrays[0].shape)
+    axis = axis % len(shape)
+    for a in arrays[1:]:
+        if a.ndim != len(shape) or any(n != m for i, (n, m) in enumerate(zip(a.shape, shape))
+                                       if i != axis):
+            raise ValueError('cannot concatenate shapes %s and %s along axis %d' %
+                             (tuple(shape), a.shape, axis))
+    shape[axis] = sum(a.shape[axis] for a in arrays)
+    res = np.empty(shape, dtype=np.result_type(*arrays))
+    index = [slice(None)] * len(shape)
+    start = 0
+    for a in arrays:
+        index[axis] = slice(start, start + a.shape[axis])
+        res[tuple(index)] = a
+        start += a.shape[axis]
+    return res
+
+
+class MatStructArray(object):
+    """Array of structs with the same fields (Matlab struct array) stored by columns
+
+    Each field is stored as a single NumPy array (column) whose leading axes have
+    the shape of the struct array; fields with values of different shapes or types
+    are stored as object arrays.
+
+    * arr.field or arr['field'] returns the whole column
+    * arr[i] returns a MatStruct view of a single element, assignments to its
+      fields write through to the columns
+    * slices, boolean and integer arrays return a new MatStructArray
+    * Save and load to/from Matlab-compatible HDF5 files (Matlab struct arrays)
+
+    :param fields: list/tuple of (name, column) pairs or a dict-like object
+    :param shape: shape of the struct array, the length of the first column by default
+    """
+
+    def __init__(self, fields=(), shape=None):
+        self._columns = _OrderedDict()
+        if isinstance(fields, dict):
+            fields = fields.items()
+        fields = [(name, _as_column(column)) for name, column in fields]
+        if shape is None:
+            shape = fields[0][1].shape[:1] if fields else (0, )
+        self._shape = tuple(shape)
+        for name, column in fields:
+            self[name] = column
+
+    @classmethod
+    def from_structs(cls, structs):
+        '''Create from a sequence of MatStruct (or dict) objects with the same fields
+        '''
+        structs = list(structs)
+        names = list(structs[0].keys()) if structs else []
+        for struct in structs:
+            if set(struct.keys()) != set(names):
+                raise KeyError('all structs must have the same fields')
+        return cls([(name, _column([struct[name] for struct in structs])) for name in names],
+                   shape=(len(structs), ))
+
+    @classmethod
+    def from_records(cls, records):
+        '''Create from a NumPy structured array
+
+        Object fields holding values of the same shape and type (e.g. read from
+        a Matlab struct array) are converted to regular columns.
+        '''
+        records = np.asarray(records)
+        columns = []
+        for name in records.dtype.names:
+            column = records[name]
+            if column.dtype == object:
+                column = _column(list(column.flat))
+                column = column.reshape(records.shape + column.shape[1:])
+            columns.append((name, column))
+        return cls(columns, shape=records.shape)
+
+    def to_records(self):
+        '''Convert to a NumPy structured array (the columns are copied)
+        '''
+        ndim = len(self._shape)
+        dtype = [(str(name), column.dtype, column.shape[ndim:])
+                 for name, column in self._columns.items()]
+        records = np.empty(self._shape, dtype=dtype)
+        for name, column in self._columns.items():
+            records[name] = column
+        return records
+
+    def to_structs(self):
+        '''Convert to a list of MatStruct objects (the values are copied)
+        '''
+        return [MatStruct(view.items(), dedict=False) for view in self]
+
+    @property
+    def shape(self):
+        '''Shape of the struct array
+        '''
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self._shape))
+
+    @property
+    def fields(self):
+        '''Field names
+        '''
+        return list(self._columns.keys())
+
+    def __len__(self):
+        if not self._shape:
+            raise TypeError('len() of unsized object')
+        return self._shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('_columns')
+        if columns is not None and name in columns:
+            return columns[name]
+        raise AttributeError('no attribute "%s"' % name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            self.__dict__[name] = value
+        else:
+            self[name] = value
+
+    def __delattr__(self, name):
+        if name in self._columns:
+            del self._columns[name]
+        else:
+            raise AttributeError("no attribute '%s'" % (name))
+
+    def __getitem__(self, key):
+        if isinstance(key, six.string_types):
+            return self._columns[key]
+        if np.ndim(np.broadcast_to(0, self._shape)[key]) == 0:
+            return _StructView(self, key)
+        columns = [(name, column[key]) for name, column in self._columns.items()]
+        return self.__class__(columns, shape=np.broadcast_to(0, self._shape)[key].shape)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, six.string_types):
+            # new or replaced field
+            MatStruct._MatStruct__is_valid_key(key)
+            column = _as_column(value)
+            if column.shape[:len(self._shape)] != self._shape:
+                column = np.array(np.broadcast_to(column, self._shape + column.shape))
+            self._columns[key] = column
+        elif isinstance(value, MatStructArray):
+            for name, column in self._columns.items():
+                column[key] = value._columns[name]
+        else:
+            # single struct
+            if set(value.keys()) != set(self._columns.keys()):
+                raise KeyError('the struct must have the fields %s' % self.fields)
+            for name, column in self._columns.items():
+                column[key] = value[name]
+
+    def __delitem__(self, name):
+        del self._columns[name]
+
+    def __dir__(self):
+        return sorted(set(dir(self.__class__)) | set(self._columns.keys()) |
+                      set(self.__dict__.keys()))
+
+    def __repr__(self):
+        return '%s(shape=%s, fields=%s)' % (self.__class__.__name__, self._shape, self.fields)
+
+    def saveh5(self, file_name, path='/', truncate_existing=False,
+               matlab_compatible=False, **kwargs):
+        """Save to an HDF5 file
+
+        :param file_name: output file name
+        :param path: path to store the struct array to
+        """
+        hdf5storage.write(self, path, file_name, truncate_existing=truncate_existing,
+                          marshaller_collection=MatStruct._MatStruct__mc(),
+                          matlab_compatible=matlab_compatible)
+
+    @classmethod
+    def loadh5(cls, file_name, path='/', matlab_compatible=False, **kwargs):
+        """Load from an HDF5 file
+
+        :param file_name: file name
+        :param path: path to read data from
+        """
+        data = hdf5storage.read(path, file_name,
+                                marshaller_collection=MatStruct._MatStruct__mc(),
+                                matlab_compatible=matlab_compatible)
+        if not isinstance(data, MatStructArray):
+            data = cls.from_records(data)
+        return data
+
+    def savemat(self, file_name, path='/', truncate_existing=False, **kwargs):
+        """Save to a Matlab (HDF5 format) file
+
+        :param file_name: output file name
+        :param path: path to store the struct array to (the Matlab variable name)
+        """
+        self.saveh5(file_name, path, truncate_existing=truncate_existing,
+                    matlab_compatible=True, **kwargs)
+
+    @classmethod
+    def loadmat(cls, file_name, path='/', **kwargs):
+        """Load from a Matlab (HDF5 format) file
+
+        :param file_name: file name
+        :param path: path to read data from (the Matlab variable name)
+        """
+        return cls.loadh5(file_name, path, matlab_compatible=True, **kwargs)
+
+
+class _StructView(MatStruct):
+    """Single element of a MatStructArray, assignments write through to the columns
+
+    :param array: MatStructArray
+    :param index: index of the element
+    """
+
+    def __init__(self, array, index):
+        super(_StructView, self).__init__([(name, column[index])
+                                           for name, column in array._columns.items()],
+                                          dedict=False)
+        self._array = array
+        self._index = index
+
+    def __setitem__(self, item, value):
+        if item not in self:
+            raise KeyError('fields can be added to the whole %s only' %
+                           self._array.__class__.__name__)
+        column = self._array._columns[item]
+        column[self._index] = value
+        super(_StructView, self).__setitem__(item, column[self._index])
+
+    def copy(self):
+        return MatStruct(self.items(), dedict=False, any_keys=self._any_keys)
+
+    def __reduce__(self):
+        # pickled (and deep-copied) as a detached MatStruct
+        return self.copy().__reduce__()
+
+
+def _as_column(value):
+    """Convert a field value to an array, lists and tuples by _column (ragged values allowed)
+    """
+    if isinstance(value, (list, tuple)):
+        return _column(value)
+    return np.asanyarray(value)
+
+
+def _column(values):
+    """Stack values into a NumPy column, object array if the values differ in shape or type
+    """
+    arrays = [np.asanyarray(value) for value in values]
+    if (arrays and all(a.dtype != object for a in arrays) and
+            len(set((a.shape, a.dtype.kind) for a in arrays)) == 1):
+        return np.stack(arrays) if arrays[0].ndim else np.array(arrays)
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
 def loadmat(file_name, path='/', **kwargs):
     """Shortcut to MatStruct.loadmat
 
@@ -358,14 +951,72 @@ def load(file_name, path='/', **kwargs):
     return load_func(file_name, path='/', **kwargs)
 
 
+def stats(counters=None):
+    """Snapshot of the cache and I/O counters
+
+    Returns a MatStruct with the cache hits, misses and evictions, the bytes resident
+    in the cache, the number of reads, bytes read (after decompression) and the read
+    time in seconds, and per data set read statistics (datasets['file:path']).
+
+    :param counters: counters from collect_stats, process-wide counters by default
+    """
+    if counters is None:
+        counters = pydons.instrument.GLOBAL
+    info = LazyDataset.cache_info()
+    res = MatStruct()
+    res.hits = counters.hits
+    res.misses = counters.misses
+    res.evictions = counters.evictions
+    res.cache_nbytes = info.nbytes
+    res.cache_max_nbytes = info.max_nbytes
+    res.cache_entries = info.entries
+    res.reads = counters.reads
+    res.read_bytes = counters.read_bytes
+    res.read_time = counters.read_time
+    res.datasets = MatStruct(any_keys=True)
+    for (filepath, path), (reads, nbytes, total, maximum) in sorted(counters.datasets.items()):
+        res.datasets['%s:%s' % (filepath, path)] = MatStruct((('reads', reads),
+                                                              ('read_bytes', nbytes),
+                                                              ('read_time', total),
+                                                              ('max_read_time', maximum)))
+    return res
+
+
+def collect_stats():
+    """Context manager collecting cache and I/O counters within a block of code
+
+    ::
+
+      with pydons.collect_stats() as counters:
+          fb.signal[1000:2000]
+      print(pydons.stats(counters).read_bytes)
+    """
+    return pydons.instrument.collect()
+
+
 if NETCDF4:
     class NC4File(netCDF4.Dataset):
         """NetCDF 4 file with __getitem__"""
         def __init__(self, *args, **argv):
             super(NC4File, self).__init__(*args, **argv)
+            # resolved groups and variables by key, netCDF4 sets other attributes in the file
+            self.__dict__['_items'] = {}
 
         def __getitem__(self, key):
-            '''Get item from a key specified as a posix path'''
+            '''Get item from a key specified as a posix path
+
+            Resolved items are cached until the file is closed.
+            '''
+            items = self.__dict__['_items']
+            item = items.get(key)
+            if item is None:
+                item = self._resolve(key)
+                if item is not self:
+                    # the root is not cached to avoid a reference cycle
+                    items[key] = item
+            return item
+
+        def _resolve(self, key):
             grp = self
             # remove leading /
             while key.startswith('/'):
@@ -387,139 +1038,344 @@ if NETCDF4:
             else:
                 raise KeyError('%s not found' % key)
 
+        def close(self):
+            self.__dict__['_items'].clear()
+            return super(NC4File, self).close()
+
+
+# serialises calls into the HDF5 and netCDF4 libraries
+_IO_LOCK = threading.RLock()
+
 
 class LazyDataset(object):
     """NetCDF 4 / HDF5 data set object with lazy evaluation"""
 
-    __cache_objs = deque()
-    __cache_size = 0
-    MAX_CACHE_SIZE = int(1e8)
+    # global cache of data shared by all instances, the limit is in bytes
+    _cache = pydons.cache.LRUCache(int(8e8), listener=pydons.instrument.cache_event)
+    # open files shared by all instances
+    # files are closed (evicted) only with _IO_LOCK held, i.e. not during a read
+    _files = pydons.filepool.FilePool(max_open=128, lock=_IO_LOCK)
 
     def __init__(self, grp, name, squeeze=False, transpose=False,
-                 lazy_min_size=10, lazy_max_size=100000000):
+                 lazy_min_size=10, lazy_max_size=100000000, mmap=False):
         if NETCDF4 and isinstance(grp, (netCDF4.Group, netCDF4.Dataset)):
-            self._fileclass = NC4File
-            self._filepath = os.path.abspath(grp.filepath())
-            fileobj = grp
-            while fileobj.parent is not None:
-                fileobj = fileobj.parent
-            self._fileobj = fileobj
-            self._path = posixpath.join(grp.path, name)
-            dset = grp.variables[name]
+            fileclass = NC4File
+            filepath = os.path.abspath(grp.filepath())
+            path = posixpath.join(grp.path, name)
         elif isinstance(grp, h5py.Group):
-            self._fileclass = h5py.File
-            self._filepath = os.path.abspath(grp.file.filename)
-            self._fileobj = grp.file
-            self._path = posixpath.join(grp.name, name)
-            self._data = None
-            dset = grp[name]
+            fileclass = h5py.File
+            filepath = os.path.abspath(grp.file.filename)
+            path = posixpath.join(grp.name, name)
         else:
             raise TypeError('%s not supported' % type(grp))
+        meta = _dataset_meta(_variable(grp, name), mmap=mmap)
+        self._setup(fileclass, filepath, path, meta, squeeze, transpose,
+                    lazy_min_size, lazy_max_size, mmap)
+
+    @classmethod
+    def _from_meta(cls, fileclass, filepath, path, meta, squeeze=False, transpose=False,
+                   lazy_min_size=10, lazy_max_size=100000000, mmap=False):
+        '''Create a data set from its metadata (see _dataset_meta) without opening the file
+
+        :param fileclass: file class (h5py.File or NC4File)
+        :param filepath: absolute file path
+        :param path: data set path in the file
+        :param meta: metadata dict
+        '''
+        obj = cls.__new__(cls)
+        obj._setup(fileclass, filepath, path, meta, squeeze, transpose,
+                   lazy_min_size, lazy_max_size, mmap)
+        return obj
+
+    def _setup(self, fileclass, filepath, path, meta, squeeze, transpose,
+               lazy_min_size, lazy_max_size, mmap):
+        self._fileclass = fileclass
+        self._filepath = filepath
+        self._path = path
         self._squeeze = squeeze
         self._transpose = transpose
-        self._data = None
-        self.__global_cache = False
+        self._cache_key = ('data', id(self))
         self._lazy_min_size = lazy_min_size
         self._lazy_max_size = lazy_max_size
-        # preloaded attributes (the order is important for squeeze)
-        for prop in ('dtype', 'dimensions', 'shape', 'size', 'ndim', 'title', 'units'):
-            # FIXME transpose, squeeze -> shape, ndim
-            if hasattr(dset, prop):
-                setattr(self, prop, getattr(dset, prop))
-                if self._transpose:
-                    if prop == 'shape':
-                        self.shape = self.shape[::-1]
-                    elif prop == 'dimensions':
-                        self.dimensions = self.dimensions[::-1]
-                if self._squeeze:
-                    if prop == 'shape':
-                        self.shape = tuple((i for i in self.shape if i > 1))
-                    elif prop == 'ndim':
-                        self.ndim = len(self.shape)
-                    elif prop == 'dimensions' and hasattr(self, 'shape'):
-                        newdims = []
-                        for i, dim in zip(self.shape, self.dimensions):
-                            if i > 1:
-                                newdims.append(dim)
-                        self.dimensions = tuple(newdims)
-        if self.size <= lazy_min_size:
+        self._disk_shape = meta['shape']
+        # disk axes in the user order: squeeze drops singleton axes, transpose reverses
+        axes = [i for i, n in enumerate(self._disk_shape) if not (squeeze and n == 1)]
+        self._axes = tuple(axes[::-1] if transpose else axes)
+        self.dtype = meta['dtype']
+        self.size = meta['size']
+        self.shape = tuple(self._disk_shape[i] for i in self._axes)
+        self.ndim = len(self.shape)
+        if 'dimensions' in meta:
+            self.dimensions = tuple(meta['dimensions'][i] for i in self._axes)
+        # preloaded attributes
+        for prop in ('title', 'units'):
+            if prop in meta:
+                setattr(self, prop, meta[prop])
+        # chunk shape on the disk, None for contiguous data sets
+        self._chunks = meta['chunks']
+        # filters of chunked HDF5 data that can be decoded outside the HDF5 library
+        self._raw_filters = meta['raw_filters']
+        # file offset of contiguous HDF5 data for read-only memory mapping
+        self._mmap_offset = meta.get('mmap_offset') if mmap else None
+        self._memmap = None
+        if 'value' in meta:
+            self._cache_data(self._to_user(meta['value']))
+        elif self.size <= lazy_min_size:
             self._get_data()
-        if hasattr(dset, 'attrs'):
-            # attributes can have any keys
-            self.attrs = MatStruct(dset.attrs, any_keys=True)
+        # attributes are read on the first access unless included in the metadata
+        self._attrs = meta.get('attrs')
+
+    def _dataset(self):
+        '''Get the data set object from the shared pool of open files
+
+        Must be called with _IO_LOCK held.
+        '''
+        return self._files.get(self._fileclass, self._filepath, self._path)
+
+    @property
+    def attrs(self):
+        '''Attributes of the data set (MatStruct with any keys), read on the first access
+        '''
+        attrs = self._attrs
+        if attrs is None:
+            with _IO_LOCK:
+                attrs = _dataset_attrs(self._dataset())
+        if not isinstance(attrs, MatStruct):
+            attrs = self._attrs = MatStruct(attrs, any_keys=True)
+        return attrs
+
+    @attrs.setter
+    def attrs(self, value):
+        self._attrs = value
+
+    def _read(self, block, cache=True):
+        '''Read a hyperslab (tuple of slices) from the file
+
+        Chunked data sets are read chunk by chunk through the global cache,
+        unless the chunks touched by the hyperslab would not fit in the cache.
+        '''
+        with _IO_LOCK:
+            # chunks of a modified file must not be served from the cache
+            dset, version = self._files.lookup(self._fileclass, self._filepath, self._path)
+            # variable-length data (netCDF4 str, object items) are not split into chunks
+            if (self._chunks is None or not isinstance(self.dtype, np.dtype) or
+                    self.dtype.hasobject):
+                return self._timed(dset.__getitem__, block)
+        parts = list(pydons.selection.chunk_grid(block, self._chunks, self._disk_shape))
+        chunk_nbytes = int(np.prod(self._chunks)) * self.dtype.itemsize
+        if cache and len(parts) * chunk_nbytes > self._cache.max_nbytes:
+            cache = False
+        if not parts or (not cache and self._raw_filters is None):
+            with _IO_LOCK:
+                return self._timed(self._dataset().__getitem__, block)
+        out = None
+        for coords, chunk, src, dst in parts:
+            key = ('chunk', self._filepath, version, self._path, coords)
+            data = self._cache.get(key) if cache else None
+            if data is None:
+                data = self._timed(self._read_chunk, chunk)
+                if cache:
+                    self._cache.put(key, data)
+            if out is None:
+                if isinstance(data, np.ma.MaskedArray):
+                    out = np.ma.empty(pydons.selection.block_shape(block), dtype=data.dtype)
+                    # keep the fill value of the variable (netCDF4 _FillValue)
+                    out.fill_value = data.fill_value
+                else:
+                    out = np.empty(pydons.selection.block_shape(block), dtype=data.dtype)
+            out[dst] = data[src]
+        return out
+
+    def _read_chunk(self, chunk):
+        '''Read a single chunk given by its extent (tuple of slices)
+
+        Raw chunks are read with the I/O lock held and decompressed outside it,
+        so that several threads can decompress in parallel. The data set is
+        resolved in each locked section, the file may be closed in between.
+        '''
+        if self._raw_filters is not None:
+            with _IO_LOCK:
+                try:
+                    filter_mask, raw = self._dataset().id.read_direct_chunk(tuple(s.start for s in chunk))
+                except (RuntimeError, OSError, KeyError, ValueError):
+                    # chunk not allocated
+                    raw = None
+            if raw is not None:
+                data = _decode_chunk(raw, filter_mask, self._raw_filters,
+                                     self.dtype, self._chunks)
+                return data[tuple(slice(0, s.stop - s.start) for s in chunk)]
+        with _IO_LOCK:
+            return self._dataset()[chunk]
+
+    def _timed(self, read, *args):
+        '''Call a read function and record the I/O statistics
+        '''
+        start = timeit.default_timer()
+        data = read(*args)
+        pydons.instrument.read_event(self._filepath, self._path, pydons.cache.nbytes(data),
+                                     timeit.default_timer() - start)
+        return data
+
+    def _read_full(self):
+        '''Read the whole data set and cache it if allowed by lazy_max_size
+        '''
+        if self._raw_filters is not None:
+            data = self._read(tuple(slice(0, n, 1) for n in self._disk_shape), cache=False)
+        else:
+            with _IO_LOCK:
+                dset = self._dataset()
+                data = self._timed(dset.__getitem__, () if len(dset.shape) == 0 else slice(None))
+        data = self._to_user(data)
+        # cache data if the size is small
+        if self.size <= self._lazy_max_size:
+            self._cache_data(data)
+        return data
+
+    def _map(self):
+        '''Read-only memory map of the data with squeeze and transpose applied
+        '''
+        if self._memmap is None:
+            self._memmap = self._to_user(np.memmap(self._filepath, dtype=self.dtype, mode='r',
+                                                   offset=self._mmap_offset,
+                                                   shape=self._disk_shape))
+        return self._memmap
+
+    def _disk_block(self, block):
+        '''Map a hyperslab in the user axes to the disk axes
+        '''
+        disk_block = [slice(0, n, 1) for n in self._disk_shape]
+        for s, axis in zip(block, self._axes):
+            disk_block[axis] = s
+        return tuple(disk_block)
+
+    def _to_user(self, data):
+        '''Squeeze and transpose data read from the disk to the user axes
+        '''
+        if not self._disk_shape:
+            return data
+        if self._squeeze and len(self._axes) < len(self._disk_shape):
+            data = np.squeeze(data, axis=tuple(i for i in range(len(self._disk_shape))
+                                               if i not in self._axes))
+        if self._transpose:
+            kept = sorted(self._axes)
+            data = np.transpose(data, [kept.index(axis) for axis in self._axes])
+        return data
 
     def _get_data(self, key=None):
-        if self._data is None:
-            # with self._fileclass(self._filepath, 'r') as f:
-            if hasattr(self._fileobj, '_isopen'):
-                if not self._fileobj._isopen:
-                    self._fileobj = self._fileclass(self._filepath, 'r')
-            elif hasattr(self._fileobj, 'id'):
-                if not self._fileobj.id.valid:
-                    self._fileobj = self._fileclass(self._filepath, 'r')
-            else:
-                self._fileobj = self._fileclass(self._filepath, 'r')
-            f = self._fileobj
-            if len(f[self._path].shape) == 0:
-                data = f[self._path][()]
-            else:
-                data = f[self._path][:]
-            if self._squeeze:
-                data = np.squeeze(data)
-            if self._transpose:
-                data = np.transpose(data)
-            # cache data if the size is small
-            if self.size <= self._lazy_max_size:
-                self._cache_data(data)
+        if self._mmap_offset is not None:
+            data = self._map()
+        elif self.size <= self._lazy_max_size:
+            data = self._cache.get(self._cache_key)
         else:
-            data = self._data
+            data = None
+        if data is not None:
+            pass
+        elif key is None:
+            data = self._read_full()
+        else:
+            # read only the selected hyperslab unless the whole data is requested
+            sel = pydons.selection.hyperslab(key, self.shape)
+            if sel is None or pydons.selection.is_full(sel[0], self.shape):
+                data = self._read_full()
+            else:
+                block, post = sel
+                data = self._to_user(self._read(self._disk_block(block)))
+                if pydons.selection.is_trivial(post):
+                    return data
+                return data[post]
         if key is None:
             return data
         else:
             return data[key]
 
+    @property
+    def _data(self):
+        '''Cached data or None
+        '''
+        return self._cache.peek(self._cache_key)
+
     def _cache_data(self, data):
-        # private object's cache
-        if data.size <= self._lazy_max_size:
-            self._data = data
-        # global cache counter
-        if data.size <= self.__class__.MAX_CACHE_SIZE:
-            self.__global_cache = True
-            self.__class__.__cache_objs.appendleft(weakref.ref(self))
-            self.__class__.__cache_size += data.size
-            # pop cache objects until the total cache size
-            # is <= MAX_CACHE_SIZE
-            while self.__class__.__cache_size > self.__class__.MAX_CACHE_SIZE:
-                print('pop')
-                obj = self.__class__.__cache_objs.pop()()
-                # references to deleted objects might exist
-                if obj is not None:
-                    obj.__global_cache = False
-                    self.__class__.__cache_size -= obj._data.size
-                    obj._data = None
+        if np.size(data) <= self._lazy_max_size:
+            self._cache.put(self._cache_key, data)
 
     def _clear_data(self):
         '''Clear data cache
         '''
-        if self.__global_cache:
-            # refs to non-existing objects can stay
-            # self.__class__.__cache_objs.remove(weakref.ref(self))
-            if self.__global_cache:
-                self.__class__.__cache_size -= self.size
-                self.__global_cache = False
-                self._data = None
+        self._cache.pop(self._cache_key)
 
     def __getitem__(self, key):
         """Get slice (read rada)"""
         return self._get_data(key)
 
+    def aread(self, key=None):
+        '''Read data asynchronously: ``data = await dataset.aread(key)``
+
+        The read runs in a bounded thread pool (see pydons.aio.set_max_workers),
+        concurrent reads of the same selection are coalesced.
+
+        :param key: selection (index), the whole data by default
+        '''
+        import pydons.aio
+        return pydons.aio.read(self, key)
+
     def __getattr__(self, attr):
         return getattr(self._get_data(), attr)
 
     def __iter__(self):
-        # iterate over data
+        # iterate over data, large data sets are read block by block
+        if (self._mmap_offset is None and self.size > self._lazy_max_size and
+                self.ndim > 0):
+            return (row for block in self.iter_blocks() for row in block)
         return iter(self._get_data())
 
+    def iter_blocks(self, axis=0, block_size=None, prefetch=True, target_nbytes=2 ** 23):
+        '''Iterate over consecutive blocks of data along an axis
+
+        By default, blocks are aligned to the chunks on the disk, spanning as many
+        chunks as fit in target_nbytes; blocks of contiguous data have about
+        target_nbytes. The blocks are read directly, bypassing the global cache.
+
+        :param axis: axis to iterate along
+        :param block_size: number of items along the axis in each block
+        :param prefetch: read the next block in a background thread
+        :param target_nbytes: target block size in bytes if block_size is None
+        '''
+        if self.ndim == 0:
+            raise TypeError('iteration over a 0-d data set')
+        if axis < 0:
+            axis += self.ndim
+        length = self.shape[axis]
+        if block_size is None:
+            # variable-length items (netCDF4 str) are counted as 1 byte
+            itemsize = max(1, np.dtype(self.dtype).itemsize)
+            slab_nbytes = max(1, self.size // max(1, length) * itemsize)
+            block_size = max(1, target_nbytes // slab_nbytes)
+            if self._chunks is not None:
+                chunk = self._chunks[self._axes[axis]]
+                block_size = max(1, block_size // chunk) * chunk
+        blocks = [(slice(None), ) * axis + (slice(start, min(start + block_size, length)), )
+                  for start in range(0, length, block_size)]
+        data = self._map() if self._mmap_offset is not None else self._data
+        if data is not None:
+            for key in blocks:
+                yield data[key]
+            return
+
+        def read(key):
+            block, _ = pydons.selection.hyperslab(key, self.shape)
+            return self._to_user(self._read(self._disk_block(block), cache=False))
+
+        if not prefetch or not blocks or ThreadPoolExecutor is None:
+            for key in blocks:
+                yield read(key)
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(read, blocks[0])
+            for key in blocks[1:]:
+                current, future = future, executor.submit(read, key)
+                yield current.result()
+            yield future.result()
+
     def __array__(self):
         # for numpy
         return self._get_data()
@@ -532,18 +1388,167 @@ class LazyDataset(object):
     def __del__(self):
         '''Delete object from global cache registry
         '''
-        if self and self.__global_cache:
-            # self.__class__.__cache_objs.remove(weakref.ref(self))
-            self.__class__.__cache_size -= self.size
+        key = self.__dict__.get('_cache_key')
+        if key is not None:
+            self._cache.pop(key)
+
+    @classmethod
+    def set_cache_limit(cls, nbytes):
+        '''Set the maximum size of the global data cache in bytes
+
+        Least recently used data are evicted if the cache exceeds the new limit.
+        '''
+        cls._cache.set_limit(nbytes)
+
+    @classmethod
+    def cache_info(cls):
+        '''Global data cache statistics
+
+        :return: CacheInfo(hits, misses, evictions, nbytes, max_nbytes, entries)
+        '''
+        return cls._cache.info()
+
+    @classmethod
+    def set_max_open_files(cls, max_open):
+        '''Set the maximum number of files kept open by the shared file pool
+        '''
+        cls._files.set_max_open(max_open)
+
+    @classmethod
+    def close_files(cls, file_name=None):
+        '''Close files in the shared pool (all files by default)
+
+        Files are reopened automatically when data are read again.
+        '''
+        cls._files.close(file_name)
 
     @classmethod
     def _clear_cache(cls):
-        while cls.__cache_objs:
-            obj = cls.__cache_objs.pop()()
-            if obj is not None:
-                obj.__global_cache = False
-                obj._data = None
-        cls.__cache_size = 0
+        cls._cache.clear()
+
+
+# close the pooled files before the interpreter tears down the modules
+atexit.register(LazyDataset.close_files)
+
+
+class VirtualDataset(LazyDataset):
+    """Data sets of the same layout concatenated (or stacked) along an axis without copying
+
+    Selections are read from the data sets they fall into only, each by its own
+    hyperslab read. The result of full reads is cached like for LazyDataset.
+    Attributes (attrs, dimensions, title, units) are those of the first data set.
+
+    :param parts: list of LazyDataset objects
+    :param axis: concatenation axis
+    :param stack: stack the data sets along a new axis instead of the concatenation
+    """
+
+    def __init__(self, parts, axis=0, stack=False):
+        parts = list(parts)
+        if not parts:
+            raise ValueError('need at least one data set')
+        first = parts[0]
+        ndim = first.ndim + 1 if stack else first.ndim
+        if axis < 0:
+            axis += ndim
+        if not 0 <= axis < ndim:
+            raise ValueError('axis %d is out of bounds for %d-d data' % (axis, ndim))
+        if stack:
+            if any(part.shape != first.shape for part in parts):
+                raise ValueError('all data sets must have the same shape')
+            lengths = [1] * len(parts)
+            shape = first.shape[:axis] + (len(parts), ) + first.shape[axis:]
+        else:
+            other = first.shape[:axis] + first.shape[axis + 1:]
+            if any(part.ndim != first.ndim or part.shape[:axis] + part.shape[axis + 1:] != other
+                   for part in parts):
+                raise ValueError('all data sets must have the same shape except for axis %d' % axis)
+            lengths = [part.shape[axis] for part in parts]
+            shape = first.shape[:axis] + (sum(lengths), ) + first.shape[axis + 1:]
+        self._parts = parts
+        self._axis = axis
+        self._stack = stack
+        self._lengths = lengths
+        self._offsets = [sum(lengths[:i]) for i in range(len(lengths))]
+        self._fileclass = None
+        self._filepath = None
+        self._path = first._path
+        self._squeeze = False
+        self._transpose = False
+        self._cache_key = ('data', id(self))
+        self._lazy_min_size = first._lazy_min_size
+        self._lazy_max_size = first._lazy_max_size
+        self._disk_shape = shape
+        self._axes = tuple(range(len(shape)))
+        self.dtype = np.result_type(*[part.dtype for part in parts])
+        self.size = int(np.prod(shape))
+        self.shape = shape
+        self.ndim = len(shape)
+        # __dict__ is checked, missing attributes of LazyDataset would read the data
+        if not stack and 'dimensions' in first.__dict__:
+            self.dimensions = first.dimensions
+        for prop in ('title', 'units'):
+            if prop in first.__dict__:
+                setattr(self, prop, getattr(first, prop))
+        self._chunks = None
+        self._raw_filters = None
+        self._mmap_offset = None
+        self._memmap = None
+
+    @property
+    def attrs(self):
+        '''Attributes of the first data set
+        '''
+        return self._parts[0].attrs
+
+    def _read(self, block, cache=True):
+        '''Read a hyperslab (tuple of slices) from the data sets it intersects
+        '''
+        axis = self._axis
+        s = block[axis]
+        pieces = []
+        for part, start, length in zip(self._parts, self._offsets, self._lengths):
+            # selected indices in [start, start + length)
+            stop = min(s.stop, start + length)
+            first = s.start + max(0, -(-(start - s.start) // s.step)) * s.step
+            if first >= stop:
+                continue
+            dst = (first - s.start) // s.step
+            count = len(range(first, stop, s.step))
+            if self._stack:
+                data = np.expand_dims(_read_block(part, block[:axis] + block[axis + 1:], cache),
+                                      axis)
+            else:
+                sub = slice(first - start, stop - start, s.step)
+                data = _read_block(part, block[:axis] + (sub, ) + block[axis + 1:], cache)
+            pieces.append((slice(dst, dst + count), data))
+        masked = [data for _, data in pieces if isinstance(data, np.ma.MaskedArray)]
+        # the read data may differ from the disk type (unpacked netCDF4 variables)
+        dtype = np.result_type(*[data.dtype for _, data in pieces]) if pieces else self.dtype
+        out = (np.ma.empty if masked else np.empty)(pydons.selection.block_shape(block),
+                                                    dtype=dtype)
+        if masked:
+            out.fill_value = masked[0].fill_value
+        for dst, data in pieces:
+            out[(slice(None), ) * axis + (dst, )] = data
+        return out
+
+    def _read_full(self):
+        '''Read the whole data and cache it if allowed by lazy_max_size
+        '''
+        data = self._read(tuple(slice(0, n, 1) for n in self.shape))
+        if self.size <= self._lazy_max_size:
+            self._cache_data(data)
+        return data
+
+
+def _read_block(dataset, block, cache=True):
+    """Read a hyperslab in the user axes of a LazyDataset, from the memory if possible
+    """
+    data = dataset._map() if dataset._mmap_offset is not None else dataset._data
+    if data is not None:
+        return data[block]
+    return dataset._to_user(dataset._read(dataset._disk_block(block), cache=cache))
 
 
 class FileBrowser(MatStruct):
@@ -553,93 +1558,780 @@ class FileBrowser(MatStruct):
     :param file_type: file type, default (None) for autodetect
     :param lazy_min_size: data sets with a lower size will be always stored in the memory
     :param lazy_max_size: data sets with a larger size will never be stored in the memory
+    :param mmap: memory map contiguous uncompressed HDF5 data sets (read-only numpy.memmap)
+    :param lazy_groups: read the content of groups on the first access
+    :param index: persistent metadata index used while the file is unchanged (same size
+        and modification time): True for an index in the user cache directory, or a
+        directory for the index files; only index files of the current user are loaded
+    :param include: glob patterns of the absolute paths of the groups and data sets to read
+        (fnmatch, * matches / too, patterns without the leading / match at any depth)
+    :param exclude: glob patterns of the paths to skip, excluded groups are not read at all
+    :param max_depth: maximum depth of the groups to read (0 for the root group only)
     """
 
     def __init__(self, file_name, file_type=None,
                  squeeze=False, transpose=None,
                  lazy_min_size=10, lazy_max_size=int(1e7),
-                 any_keys=False):
+                 any_keys=False, mmap=False, lazy_groups=False, index=None,
+                 include=None, exclude=None, max_depth=None):
         super(FileBrowser, self).__init__(any_keys=any_keys)
-        # get the file type and corresponding classes
-        _, ext = os.path.splitext(file_name)
-        ext = ext[1:]
-        if file_type is None:
-            if ext.lower() in ('nc', 'cdf'):
-                file_type = 'cdf'
-            elif ext.lower() in ('h5', 'hdf5', 'he5', 'hdf-5'):
-                file_type = 'hdf5'
-            elif ext.lower() in ('mat'):
-                file_type = 'hdf5'
-                if transpose is None:
-                    transpose = True
-            else:
-                # HDF5 as a default fall back
-                file_type = 'hdf5'
-        if transpose is None:
-            transpose = False
-
-        if file_type.lower() in ('nc', 'cdf', 'netcdf', 'netcdf4', 'netcdf-4'):
-            if NETCDF4:
-                fileclass, dataclass = NC4File, LazyDataset
-            else:
-                raise TypeError('netCDF4 module must be installed for netCDF4 file support')
-        elif file_type.lower() in ('h5', 'hdf5', 'he5', 'hdf-5'):
-            fileclass, dataclass = h5py.File, LazyDataset
+        fileclass, dataclass, transpose = _file_classes(file_name, file_type, transpose)
+        options = dict(dataclass=dataclass, squeeze=squeeze, transpose=transpose,
+                       lazy_min_size=lazy_min_size, lazy_max_size=lazy_max_size,
+                       any_keys=any_keys, mmap=mmap, lazy_groups=lazy_groups,
+                       select=_path_filter(include, exclude, max_depth))
+        filepath = os.path.abspath(file_name)
+        self._fill(_file_tree(fileclass, filepath, options, index), fileclass, filepath, options)
+
+    def _fill(self, tree, fileclass, filepath, options):
+        # objects by their paths in the file, deleted keys release the objects
+        self._paths = weakref.WeakValueDictionary({'/': self})
+        for key, val in _build(tree, fileclass, filepath, '/', options, self._paths).items():
+            self[key] = val
+
+    def __getitem__(self, item):
+        # absolute paths in the file (not the possibly renamed keys)
+        if isinstance(item, six.string_types) and item.startswith('/'):
+            return self._lookup(item)
+        return super(FileBrowser, self).__getitem__(item)
+
+    def _lookup(self, path):
+        '''Get a group or data set by its absolute path in the file
+        '''
+        path = posixpath.normpath(path)
+        if path.startswith('//'):
+            path = path[1:]
+        item = self._paths.get(path)
+        if item is None and path != '/':
+            # the path may be inside a group that has not been expanded yet
+            group = self._lookup(posixpath.dirname(path))
+            if isinstance(group, _LazyGroup):
+                group._expand()
+            item = self._paths.get(path)
+        if item is None:
+            raise KeyError(path)
+        return item
+
+    def find(self, pattern='*', regex=False, min_size=None, max_size=None, dtype=None):
+        '''Find data sets by their absolute paths in the file and properties
+
+        Glob patterns are matched by fnmatch (* matches / too), patterns without the
+        leading / match at any depth. Regular expressions are searched for in the paths.
+        Lazy groups are expanded, no data are read.
+
+        :param pattern: glob pattern, or a regular expression if regex is True
+        :param regex: pattern is a regular expression
+        :param min_size: minimum number of elements
+        :param max_size: maximum number of elements
+        :param dtype: data type, matched by numpy.issubdtype (e.g. numpy.floating)
+        :return: MatStruct of LazyDataset objects by their paths, in the file order
+        '''
+        if regex:
+            match = re.compile(pattern).search
+        else:
+            def match(path):
+                return _match_path(pattern, path)
+        # expand all lazy groups
+        datasets = list(_datasets(self))
+        res = MatStruct(any_keys=True)
+        for dataset in datasets:
+            if ((min_size is not None and dataset.size < min_size) or
+                    (max_size is not None and dataset.size > max_size) or
+                    (dtype is not None and not np.issubdtype(dataset.dtype, dtype)) or
+                    not match(dataset._path)):
+                continue
+            res[dataset._path] = dataset
+        return res
+
+    @classmethod
+    def open_many(cls, paths, processes=None, file_type=None,
+                  squeeze=False, transpose=None,
+                  lazy_min_size=10, lazy_max_size=int(1e7),
+                  any_keys=False, mmap=False, lazy_groups=False, index=None,
+                  include=None, exclude=None, max_depth=None):
+        '''Browse many files, their metadata can be read in parallel worker processes
+
+        The workers send back the metadata trees (including the data of data sets
+        up to lazy_min_size), the data sets open the files in this process on the
+        first read. The workers are started by spawn, i.e. they import the main
+        module: scripts using them must be guarded by if __name__ == '__main__'.
+        See FileBrowser for the other parameters.
+
+        :param paths: list of file names or a glob pattern
+        :param processes: number of worker processes, the files are read in this
+            process by default (None), if processes is 1 and on Python < 3.7
+        :return: list of FileBrowser objects, in the order of the sorted file names
+            for a glob pattern
+        '''
+        if isinstance(paths, six.string_types):
+            paths = sorted(glob.glob(paths))
+        select = _path_filter(include, exclude, max_depth)
+        jobs = []
+        for file_name in paths:
+            fileclass, dataclass, file_transpose = _file_classes(file_name, file_type, transpose)
+            options = dict(dataclass=dataclass, squeeze=squeeze, transpose=file_transpose,
+                           lazy_min_size=lazy_min_size, lazy_max_size=lazy_max_size,
+                           any_keys=any_keys, mmap=mmap, lazy_groups=lazy_groups,
+                           select=select)
+            jobs.append((fileclass, os.path.abspath(file_name), options, index))
+        if ((processes is None or processes <= 1) or len(jobs) <= 1 or
+                ProcessPoolExecutor is None or sys.version_info < (3, 7)):
+            # no worker processes without the spawn start method (mp_context)
+            trees = [_file_tree(*job) for job in jobs]
+        else:
+            # forking would copy the open HDF5 handles and possibly the held _IO_LOCK
+            with ProcessPoolExecutor(max_workers=processes,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                trees = list(executor.map(_file_tree_worker, jobs))
+        res = []
+        for tree, (fileclass, filepath, options, _) in zip(trees, jobs):
+            browser = cls.__new__(cls)
+            MatStruct.__init__(browser, any_keys=any_keys)
+            browser._fill(tree, fileclass, filepath, options)
+            res.append(browser)
+        return res
+
+    def prefetch(self, paths=None, max_workers=None):
+        '''Load data sets concurrently in a thread pool
+
+        Calls into the HDF5 / netCDF4 library are serialised, decompression of
+        chunked HDF5 data and post-processing run in parallel. The loaded data are
+        stored in the global cache (see lazy_max_size and LazyDataset.set_cache_limit).
+
+        :param paths: LazyDataset objects or their /-separated paths, all data sets by default
+        :param max_workers: maximum number of threads
+        :return: list of the loaded arrays
+        '''
+        datasets = self._get_datasets(paths)
+        if ThreadPoolExecutor is None:
+            return [dataset._get_data() for dataset in datasets]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda dataset: dataset._get_data(), datasets))
+
+    def read_many(self, requests):
+        '''Read several data sets (or their parts) in the order of their file offsets
+
+        The reads are grouped by file and, where the offsets are known (contiguous and
+        chunked HDF5 data), ordered by the position of their first byte in the file,
+        which reduces seeking. The files are shared through the file pool.
+
+        :param requests: {path: selection} dict or a list of paths (whole data sets),
+            paths are absolute paths in the file, /-separated keys or LazyDataset objects,
+            selections are indices as for LazyDataset.__getitem__ (None for all data)
+        :return: MatStruct of arrays with the paths as keys, in the order of the requests
+        '''
+        if isinstance(requests, dict):
+            requests = list(requests.items())
         else:
-            raise TypeError('Unknown file type: %s' % file_type)
-        # recursively read the file structure
-        with fileclass(file_name, 'r') as fileobj:
-            for key, val in _read_all(fileobj, dataclass,
-                                      squeeze=squeeze, transpose=transpose,
-                                      lazy_min_size=lazy_min_size,
-                                      lazy_max_size=lazy_max_size,
-                                      any_keys=any_keys).items():
+            requests = [(path, None) for path in requests]
+        items = []
+        for (path, key), dataset in zip(requests, self._get_datasets([r[0] for r in requests])):
+            items.append((path if isinstance(path, six.string_types) else dataset._path,
+                          dataset, key))
+        return _read_many(items)
+
+    def aread_many(self, paths=None):
+        '''Read data sets asynchronously (awaitable), see LazyDataset.aread
+
+        :param paths: LazyDataset objects or their /-separated paths, all data sets by default
+        :return: list of arrays
+        '''
+        import pydons.aio
+        return pydons.aio.read_many(self._get_datasets(paths))
+
+    def _get_datasets(self, paths=None):
+        if paths is None:
+            return list(_datasets(self))
+        datasets = []
+        for path in paths:
+            if isinstance(path, six.string_types):
+                try:
+                    path = self._lookup('/' + path.strip('/'))
+                except KeyError:
+                    # path of the (renamed) keys
+                    path = _get_path(self, path)
+            datasets.append(path)
+        return datasets
+
+
+class MultiFileBrowser(MatStruct):
+    """Browse many files with the same layout as a single MatStruct tree
+
+    Data sets with the same path are concatenated (or stacked) into VirtualDataset
+    objects, their selections read only the necessary parts of the files. Data sets
+    that are missing in some of the files or have incompatible shapes are skipped.
+    The FileBrowser objects of the individual files are kept in the _browsers list.
+
+    :param paths: list of file names or a glob pattern (the files are sorted by name)
+    :param axis: concatenation axis of the data as returned by FileBrowser (i.e. after
+        squeeze and transpose)
+    :param stack: stack the data along a new axis instead of the concatenation
+    :param processes: number of worker processes reading the metadata (if > 1, see
+        FileBrowser.open_many), the files are read in this process by default
+    :param kwargs: other FileBrowser.open_many parameters
+    """
+
+    def __init__(self, paths, axis=0, stack=False, processes=None, **kwargs):
+        any_keys = kwargs.get('any_keys', False)
+        super(MultiFileBrowser, self).__init__(any_keys=any_keys)
+        self._browsers = FileBrowser.open_many(paths, processes=processes, **kwargs)
+        if self._browsers:
+            for key, val in _virtual(self._browsers, axis, stack, any_keys).items():
                 self[key] = val
 
 
-def _read_all(basegrp, dataclass, squeeze, transpose,
-              lazy_min_size, lazy_max_size, any_keys):
-    """Recursively read all groups / variables
+def _virtual(structs, axis, stack, any_keys):
+    """Merge MatStruct trees of LazyDataset objects into a tree of VirtualDataset objects
+    """
+    res = MatStruct(any_keys=any_keys)
+    for key, value in structs[0].items():
+        values = [struct.get(key) for struct in structs]
+        if isinstance(value, LazyDataset):
+            if all(isinstance(val, LazyDataset) for val in values):
+                try:
+                    res[key] = VirtualDataset(values, axis, stack)
+                except ValueError:
+                    # incompatible shapes
+                    pass
+        elif isinstance(value, MatStruct):
+            if all(isinstance(val, MatStruct) for val in values):
+                res[key] = _virtual(values, axis, stack, any_keys)
+    return res
+
+
+def _file_classes(file_name, file_type=None, transpose=None):
+    """Get the file and data set classes for a file type (autodetected by default)
+
+    :return: (file class, data set class, transpose) tuple, transpose defaults to
+        True for MATLAB files
+    """
+    _, ext = os.path.splitext(file_name)
+    ext = ext[1:]
+    if file_type is None:
+        if ext.lower() in ('nc', 'cdf'):
+            file_type = 'cdf'
+        elif ext.lower() in ('h5', 'hdf5', 'he5', 'hdf-5'):
+            file_type = 'hdf5'
+        elif ext.lower() in ('mat'):
+            file_type = 'hdf5'
+            if transpose is None:
+                transpose = True
+        else:
+            # HDF5 as a default fall back
+            file_type = 'hdf5'
+    if transpose is None:
+        transpose = False
+
+    if file_type.lower() in ('nc', 'cdf', 'netcdf', 'netcdf4', 'netcdf-4'):
+        if NETCDF4:
+            fileclass, dataclass = NC4File, LazyDataset
+        else:
+            raise TypeError('netCDF4 module must be installed for netCDF4 file support')
+    elif file_type.lower() in ('h5', 'hdf5', 'he5', 'hdf-5'):
+        fileclass, dataclass = h5py.File, LazyDataset
+    else:
+        raise TypeError('Unknown file type: %s' % file_type)
+    return fileclass, dataclass, transpose
+
+
+def _path_filter(include=None, exclude=None, max_depth=None):
+    """Create a _PathFilter, None if nothing is filtered
+    """
+    if include is None and not exclude and max_depth is None:
+        return None
+    return _PathFilter(include, exclude, max_depth)
+
+
+def _file_tree(fileclass, filepath, options, index=None, worker=False):
+    """Read the metadata tree of a file, from the persistent index if it is fresh
+
+    :param fileclass: file class (h5py.File or NC4File)
+    :param filepath: absolute file path
+    :param options: options of _build
+    :param index: index location (see FileBrowser), no index if None or False
+    :param worker: read in a worker process, i.e. read the whole tree including
+        small data
+    """
+    kind = '%s.%s' % (fileclass.__module__, fileclass.__name__)
+    # a fresh index describes the whole file, no need to open it
+    tree = pydons.metaindex.load(filepath, kind, index) if index else None
+    if tree is not None:
+        if options['select'] is not None:
+            tree = _prune(tree, options['select'])
+        return tree
+    with _IO_LOCK:
+        # browsing alone does not keep the file open, the data sets open it in the pool
+        fileobj = fileclass(filepath, 'r')
+        try:
+            if index:
+                # the index must serve any options, small data are included
+                tree = _scan(fileobj, mmap=True, values_max_size=options['lazy_min_size'],
+                             attrs=True)
+                pydons.metaindex.save(filepath, kind, tree, index)
+            elif worker:
+                tree = _scan(fileobj, mmap=True, values_max_size=options['lazy_min_size'],
+                             attrs=True, select=options['select'])
+            else:
+                # small data are read here, not through the file pool
+                tree = _scan(fileobj, depth=1 if options['lazy_groups'] else None,
+                             mmap=options['mmap'], values_max_size=options['lazy_min_size'],
+                             select=options['select'])
+        finally:
+            fileobj.close()
+    if index and options['select'] is not None:
+        tree = _prune(tree, options['select'])
+    return tree
+
+
+def _file_tree_worker(job):
+    """_file_tree in a worker process, job is (fileclass, filepath, options, index)
+    """
+    return _file_tree(*job, worker=True)
+
+
+def _scan(basegrp, depth=None, mmap=False, values_max_size=None, attrs=False,
+          select=None, path='/'):
+    """Read the structure and metadata of a file group into a tree of plain Python objects
 
     :param basegrp: base group (the starting point)
-    :param dataclass: data type to return
+    :param depth: number of group levels to read, all by default
+    :param mmap: include the memory mapping offsets of the data sets
+    :param values_max_size: include the data of data sets up to this size
+    :param attrs: include the attributes of the data sets
+    :param select: _PathFilter, the excluded groups are not visited
+    :param path: absolute path of basegrp in the file
+    :return: dict(groups=[(name, sub-tree)], variables=[(name, metadata)]),
+        the sub-trees beyond depth are None
     """
-    res = MatStruct(any_keys=any_keys)
-    for grpname in _groups(basegrp):
+    grpnames, varnames = _children(basegrp)
+    groups = []
+    for grpname in grpnames:
+        grppath = posixpath.join(path, grpname)
+        if select is not None and not select.group(grppath):
+            continue
+        if depth is not None and depth <= 1:
+            node = None
+        else:
+            node = _scan(_subgroup(basegrp, grpname), None if depth is None else depth - 1,
+                         mmap, values_max_size, attrs, select, grppath)
+            if select is not None and _pruned(node, grppath, select):
+                continue
+        groups.append((grpname, node))
+    variables = [(varname, _dataset_meta(_variable(basegrp, varname), mmap, values_max_size,
+                                         attrs))
+                 for varname in varnames
+                 if select is None or select.dataset(posixpath.join(path, varname))]
+    return dict(groups=groups, variables=variables)
+
+
+def _prune(tree, select, path='/'):
+    """Apply a _PathFilter to a metadata tree of _scan
+    """
+    groups = []
+    for grpname, node in tree['groups']:
+        grppath = posixpath.join(path, grpname)
+        if not select.group(grppath):
+            continue
+        if node is not None:
+            node = _prune(node, select, grppath)
+            if _pruned(node, grppath, select):
+                continue
+        groups.append((grpname, node))
+    variables = [(varname, meta) for varname, meta in tree['variables']
+                 if select.dataset(posixpath.join(path, varname))]
+    return dict(groups=groups, variables=variables)
+
+
+def _pruned(node, path, select):
+    """Check if a group has been visited only because it might contain included paths
+    """
+    return not node['groups'] and not node['variables'] and not select.included(path)
+
+
+def _match_path(pattern, path):
+    """Match an absolute path by a glob pattern, patterns without the leading / match at any depth
+    """
+    return (fnmatch.fnmatchcase(path, pattern) or
+            (not pattern.startswith('/') and fnmatch.fnmatchcase(path, '*/' + pattern)))
+
+
+class _PathFilter(object):
+    """Include / exclude glob patterns on absolute paths and the maximum group depth
+
+    Data sets are selected if they or any of their groups match an include pattern
+    (all by default) and neither they nor their groups match an exclude pattern.
+    A group is visited only if it can contain selected data sets.
+
+    :param include: list of glob patterns, None for all paths
+    :param exclude: list of glob patterns
+    :param max_depth: maximum depth of groups (0 for the root group only)
+    """
+
+    def __init__(self, include=None, exclude=None, max_depth=None):
+        if isinstance(include, six.string_types):
+            include = [include]
+        if isinstance(exclude, six.string_types):
+            exclude = [exclude]
+        self.include = None if include is None else list(include)
+        self.exclude = list(exclude or ())
+        self.max_depth = max_depth
+        # literal parts of the include patterns before the first wildcard
+        self._prefixes = None
+        if self.include is not None:
+            self._prefixes = [re.split(r'[*?[]', pattern)[0] if pattern.startswith('/') else ''
+                              for pattern in self.include]
+
+    def included(self, path):
+        '''Check if a path or any of its parents matches an include pattern
+        '''
+        if self.include is None:
+            return True
+        while True:
+            if any(_match_path(pattern, path) for pattern in self.include):
+                return True
+            if path == '/':
+                return False
+            path = posixpath.dirname(path)
+
+    def group(self, path):
+        '''Check if a group must be visited
+        '''
+        if any(_match_path(pattern, path) for pattern in self.exclude):
+            return False
+        if self.max_depth is not None and path.count('/') > self.max_depth:
+            return False
+        if self.included(path):
+            return True
+        # descendants may match a pattern with a compatible literal prefix
+        path += '/'
+        return any(prefix.startswith(path) or path.startswith(prefix)
+                   for prefix in self._prefixes)
+
+    def dataset(self, path):
+        '''Check if a data set is selected
+        '''
+        return (not any(_match_path(pattern, path) for pattern in self.exclude) and
+                self.included(path))
+
+
+def _build(tree, fileclass, filepath, path, options, paths=None):
+    """Create the MatStruct tree with LazyDataset objects from a metadata tree of _scan
+
+    :param tree: metadata tree
+    :param fileclass: file class (h5py.File or NC4File)
+    :param filepath: absolute file path
+    :param path: path of the tree root in the file
+    :param options: dataclass, squeeze, transpose, lazy_min_size, lazy_max_size,
+        any_keys, mmap and lazy_groups (return _LazyGroup objects for sub-groups)
+    :param paths: dict updated with the created objects by their paths in the file
+    """
+    dataclass = options['dataclass']
+    res = MatStruct(any_keys=options['any_keys'])
+    for grpname, node in tree['groups']:
+        grppath = posixpath.join(path, grpname)
+        if node is None or options['lazy_groups']:
+            value = _LazyGroup(fileclass, filepath, grppath, options, tree=node, paths=paths)
+        else:
+            value = _build(node, fileclass, filepath, grppath, options, paths)
+        _set_key(res, grpname, value)
+        if paths is not None:
+            paths[grppath] = value
+    for varname, meta in tree['variables']:
+        varpath = posixpath.join(path, varname)
+        value = dataclass._from_meta(fileclass, filepath, varpath, meta,
+                                     options['squeeze'], options['transpose'],
+                                     options['lazy_min_size'], options['lazy_max_size'],
+                                     mmap=options['mmap'])
+        _set_key(res, varname, value)
+        if paths is not None:
+            paths[varpath] = value
+    return res
+
+
+def _set_key(struct, name, value):
+    """Store a file object under its name, or name + '_' if the name is not a valid key
+    """
+    try:
+        struct[name] = value
+    except KeyError:
+        struct[name + '_'] = value
+
+
+class _LazyGroup(MatStruct):
+    """MatStruct of a file group that reads its content on the first access
+
+    :param fileclass: file class (h5py.File or NC4File)
+    :param filepath: absolute file path
+    :param path: group path in the file
+    :param options: options of _build
+    :param tree: metadata tree of the group, read from the file if None
+    :param paths: path index updated on the expansion, see _build
+    """
+
+    # class default prevents recursion in __getattr__ before __init__ finishes
+    _expanded = True
+
+    def __init__(self, fileclass, filepath, path, options, tree=None, paths=None):
+        super(_LazyGroup, self).__init__(any_keys=options['any_keys'])
+        self._fileclass = fileclass
+        self._filepath = filepath
+        self._path = path
+        self._options = options
+        self._tree = tree
+        self._paths = paths
+        self._expanded = False
+
+    def _expand(self):
+        '''Read the group content (sub-groups stay lazy)
+        '''
+        if self._expanded:
+            return
+        with _IO_LOCK:
+            if self._expanded:
+                return
+            self._expanded = True
+            tree, self._tree = self._tree, None
+            if tree is None:
+                # temporary handle, as in _file_tree
+                fileobj = self._fileclass(self._filepath, 'r')
+                try:
+                    tree = _scan(fileobj[self._path], depth=1, mmap=self._options['mmap'],
+                                 values_max_size=self._options['lazy_min_size'],
+                                 select=self._options['select'], path=self._path)
+                finally:
+                    fileobj.close()
+            for key, val in _build(tree, self._fileclass, self._filepath, self._path,
+                                   self._options, self._paths).items():
+                MatStruct.__setitem__(self, key, val)
+
+    def __repr__(self):
+        if not self._expanded:
+            return '%s(%s: not loaded)' % (MatStruct.__name__, self._path)
+        return super(_LazyGroup, self).__repr__()
+
+    def copy(self):
+        self._expand()
+        return MatStruct(self.items(), dedict=False, any_keys=self._any_keys)
+
+
+def _expanding(name):
+    """Wrap a MatStruct method of _LazyGroup to read the group content first
+    """
+    method = getattr(MatStruct, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._expand()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__',
+              '__reversed__', '__len__', '__eq__', '__ne__', '__dir__', 'keys', 'values',
+              'items', 'get', 'pop', 'popitem', 'setdefault', 'update', 'clear',
+              'insert_after', 'insert_before', 'diff', '_repr_pretty_'):
+    if hasattr(MatStruct, _name):
+        setattr(_LazyGroup, _name, _expanding(_name))
+
+
+def _read_many(items):
+    """Read (name, LazyDataset, selection) items ordered by the file and the file offset
+
+    :return: MatStruct of the arrays by name in the original order
+    """
+    order = []
+    for i, (_, dataset, key) in enumerate(items):
+        offset = _read_offset(dataset, key)
+        # unknown offsets are read last, in the original order
+        order.append((dataset._filepath or '', offset is None, offset or 0, i))
+    data = [None] * len(items)
+    for _, _, _, i in sorted(order):
+        _, dataset, key = items[i]
+        data[i] = dataset._get_data(None if key is Ellipsis else key)
+    res = MatStruct(any_keys=True)
+    for (name, _, _), value in zip(items, data):
+        res[name] = value
+    return res
+
+
+def _read_offset(dataset, key=None):
+    """File offset of the first byte read by dataset[key], None if unknown
+    """
+    if dataset._fileclass is not h5py.File or dataset._data is not None:
+        return None
+    block = None
+    if key is not None and key is not Ellipsis:
         try:
-            res[grpname] = _read_all(_groups(basegrp)[grpname], dataclass,
-                                     squeeze, transpose,
-                                     lazy_min_size, lazy_max_size,
-                                     any_keys=any_keys)
-        except KeyError:
-            res[grpname + '_'] = _read_all(_groups(basegrp)[grpname], dataclass,
-                                           squeeze, transpose,
-                                           lazy_min_size, lazy_max_size,
-                                           any_keys=any_keys)
-    for varname in _variables(basegrp):
+            sel = pydons.selection.hyperslab(key, dataset.shape)
+        except IndexError:
+            return None
+        if sel is not None:
+            block = dataset._disk_block(sel[0])
+    with _IO_LOCK:
+        dset = dataset._dataset()
         try:
-            res[varname] = dataclass(basegrp, varname, squeeze, transpose, lazy_min_size, lazy_max_size)
-        except KeyError:
-            res[varname + '_'] = dataclass(basegrp, varname, squeeze, transpose, lazy_min_size, lazy_max_size)
-    return res
+            if dset.chunks is None:
+                return dset.id.get_offset()
+            if block is None:
+                start = (0, ) * len(dset.chunks)
+            else:
+                start = tuple(s.start // c * c for s, c in zip(block, dset.chunks))
+            return dset.id.get_chunk_info_by_coord(start).byte_offset
+        except (AttributeError, RuntimeError, KeyError, ValueError):
+            # old HDF5 / h5py, compact or empty data sets
+            return None
+
+
+def _get_path(struct, path):
+    """Get an item from a MatStruct tree by a /-separated path of keys
+    """
+    item = struct
+    for key in path.strip('/').split('/'):
+        if key:
+            item = item[key]
+    return item
+
+
+def _datasets(struct):
+    """Iterate over all LazyDataset objects in a MatStruct tree
+    """
+    for value in struct.values():
+        if isinstance(value, LazyDataset):
+            yield value
+        elif isinstance(value, MatStruct):
+            for dataset in _datasets(value):
+                yield dataset
+
+
+def _children(basegrp):
+    """Get the names of sub-groups and variables of an HDF5/netCDF4 file group
 
+    HDF5 object types are queried by name, no child objects are instantiated.
+    Objects other than groups and data sets (named data types) and dangling links
+    are skipped.
 
-def _groups(basegrp):
-    """Get group names from an HDF5/netCDF4 file group
+    :return: (group names, variable names) tuple of lists
+    """
+    if hasattr(basegrp, 'variables'):
+        return list(basegrp.groups), list(basegrp.variables)
+    grpnames, varnames = [], []
+    for name in basegrp:
+        try:
+            objtype = h5py.h5o.get_info(basegrp.id, name.encode('utf8')).type
+        except (KeyError, RuntimeError):
+            continue
+        if objtype == h5py.h5o.TYPE_GROUP:
+            grpnames.append(name)
+        elif objtype == h5py.h5o.TYPE_DATASET:
+            varnames.append(name)
+    return grpnames, varnames
+
+
+def _subgroup(basegrp, name):
+    """Get a sub-group of an HDF5/netCDF4 file group
     """
     if hasattr(basegrp, 'groups'):
-        return basegrp.groups
-    else:
-        # for HDF5 return keys that are dict-like
-        # return [key for key in basegrp.keys() if hasattr(basegrp[key], 'keys')]
-        return _OrderedDict([(key, value) for key, value in basegrp.items() if hasattr(value, 'keys')])
+        return basegrp.groups[name]
+    return basegrp[name]
 
 
-def _variables(basegrp):
-    """Get group names from an HDF5/netCDF4 file group
+def _variable(basegrp, name):
+    """Get a data set (variable) of an HDF5/netCDF4 file group
     """
     if hasattr(basegrp, 'variables'):
-        return basegrp.variables
+        return basegrp.variables[name]
+    return basegrp[name]
+
+
+def _dataset_attrs(dset):
+    """Get the attributes of an HDF5/netCDF4 data set as a list of (name, value) pairs
+    """
+    if hasattr(dset, 'ncattrs'):
+        return [(name, dset.getncattr(name)) for name in dset.ncattrs()]
+    return list(dset.attrs.items())
+
+
+def _dataset_meta(dset, mmap=False, values_max_size=None, attrs=False):
+    """Get the metadata of an HDF5/netCDF4 data set needed by LazyDataset
+
+    :param dset: data set (variable) object
+    :param mmap: include the file offset for memory mapping
+    :param values_max_size: include the data if the size does not exceed this value
+    :param attrs: include the attributes (read on the first access otherwise)
+    :return: dict of picklable values
+    """
+    meta = dict(dtype=dset.dtype, shape=dset.shape, size=dset.size)
+    for prop in ('dimensions', 'title', 'units'):
+        if hasattr(dset, prop):
+            meta[prop] = getattr(dset, prop)
+    if hasattr(dset, 'chunking'):
+        chunks = dset.chunking()
+        meta['chunks'] = None if chunks == 'contiguous' else tuple(chunks)
     else:
-        # for HDF5 return keys that are not dict-like
-        return _OrderedDict([(key, value) for key, value in basegrp.items() if not hasattr(value, 'keys')])
+        meta['chunks'] = dset.chunks
+    meta['raw_filters'] = _raw_filters(dset)
+    if mmap:
+        meta['mmap_offset'] = _contiguous_offset(dset)
+    # object references (e.g. dimension scales, Matlab cells) cannot be pickled,
+    # such values are read on the first access
+    if attrs:
+        meta['attrs'] = _dataset_attrs(dset)
+        if not _picklable(meta['attrs']):
+            del meta['attrs']
+    if values_max_size is not None and dset.size <= values_max_size:
+        meta['value'] = dset[() if len(dset.shape) == 0 else slice(None)]
+        if np.dtype(dset.dtype).hasobject and not _picklable(meta['value']):
+            del meta['value']
+    return meta
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError, ValueError):
+        return False
+    return True
+
+
+def _contiguous_offset(dset):
+    """Get the file offset of HDF5 data that can be memory mapped, None otherwise
+    """
+    if not isinstance(dset, h5py.Dataset) or not dset.shape or dset.dtype.hasobject:
+        return None
+    if dset.file.driver != 'sec2':
+        return None
+    plist = dset.id.get_create_plist()
+    if (plist.get_layout() != h5py.h5d.CONTIGUOUS or plist.get_nfilters() or
+            plist.get_external_count()):
+        return None
+    # storage is not allocated for data sets that have never been written
+    if dset.id.get_storage_size() != dset.size * dset.dtype.itemsize:
+        return None
+    return dset.id.get_offset()
+
+
+def _raw_filters(dset):
+    """Get the filter pipeline of chunked HDF5 data if it can be decoded by _decode_chunk
+    """
+    if not isinstance(dset, h5py.Dataset) or dset.chunks is None or dset.dtype.hasobject:
+        return None
+    plist = dset.id.get_create_plist()
+    filters = tuple(plist.get_filter(i)[0] for i in range(plist.get_nfilters()))
+    if not filters or not set(filters) <= set((h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE)):
+        return None
+    return filters
+
+
+def _decode_chunk(raw, filter_mask, filters, dtype, chunks):
+    """Decode a raw chunk compressed by the deflate and shuffle filters
+    """
+    # filters are undone in the reverse order, masked filters have not been applied
+    for i in reversed(range(len(filters))):
+        if filter_mask & (1 << i):
+            continue
+        if filters[i] == h5py.h5z.FILTER_DEFLATE:
+            raw = zlib.decompress(raw)
+        elif filters[i] == h5py.h5z.FILTER_SHUFFLE and dtype.itemsize > 1:
+            raw = np.frombuffer(raw, np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+    return np.frombuffer(raw, dtype).reshape(chunks)
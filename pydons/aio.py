@@ -0,0 +1,87 @@
+'''asyncio interface to LazyDataset reads (Python 3 only)
+
+Reads run on a bounded thread pool so that the event loop is not blocked by
+disk I/O. Concurrent requests for the same selection of the same data set are
+coalesced into a single read.
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numbers
+import threading
+
+
+_MAX_WORKERS = 4
+_executor = None
+_executor_lock = threading.Lock()
+# in-flight reads, (event loop, token) -> future
+_inflight = {}
+
+
+def set_max_workers(max_workers):
+    '''Set the number of threads used for asynchronous reads
+
+    :param max_workers: maximum number of concurrent reads
+    '''
+    global _MAX_WORKERS, _executor
+    with _executor_lock:
+        _MAX_WORKERS = max_workers
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS)
+        return _executor
+
+
+def _token(dataset, key):
+    '''Hashable identification of a read, None if the read cannot be coalesced
+    '''
+    if key is None:
+        return (dataset._cache_key, None)
+    items = []
+    for k in (key if isinstance(key, tuple) else (key, )):
+        if isinstance(k, slice):
+            items.append(('slice', k.start, k.stop, k.step))
+        elif k is None or k is Ellipsis or isinstance(k, numbers.Integral):
+            items.append(k)
+        else:
+            return None
+    return (dataset._cache_key, tuple(items))
+
+
+async def read(dataset, key=None):
+    '''Read data from a LazyDataset without blocking the event loop
+
+    :param dataset: LazyDataset object
+    :param key: selection (index), the whole data by default
+    '''
+    if dataset._data is not None:
+        # served from the memory
+        return dataset._get_data(key)
+    loop = asyncio.get_running_loop()
+    token = _token(dataset, key)
+    if token is None:
+        return await loop.run_in_executor(_get_executor(), dataset._get_data, key)
+    token = (loop, token)
+    future = _inflight.get(token)
+    if future is None:
+        future = loop.run_in_executor(_get_executor(), dataset._get_data, key)
+        _inflight[token] = future
+        future.add_done_callback(lambda _: _inflight.pop(token, None))
+    # a cancelled waiter must not cancel the read for the others
+    return await asyncio.shield(future)
+
+
+async def read_many(datasets):
+    '''Read several LazyDataset objects concurrently
+
+    :param datasets: iterable of LazyDataset objects
+    :return: list of arrays
+    '''
+    return list(await asyncio.gather(*[read(dataset) for dataset in datasets]))
@@ -0,0 +1,137 @@
+'''Least-recently-used cache with a byte budget shared by lazy data sets
+'''
+
+from collections import namedtuple
+from pydons import _OrderedDict
+import sys
+import threading
+
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'evictions', 'nbytes', 'max_nbytes', 'entries'))
+
+
+def nbytes(value):
+    '''Memory size of a cached value in bytes
+    '''
+    size = getattr(value, 'nbytes', None)
+    if size is None:
+        return sys.getsizeof(value)
+    # masked arrays (netCDF4) carry their mask
+    mask = getattr(value, 'mask', None)
+    return size + getattr(mask, 'nbytes', 0)
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache limited by the total size of the values in bytes
+
+    :param max_nbytes: maximum total size of the cached values
+    :param listener: function called as listener(event, key, nbytes) on 'hit', 'miss'
+        and 'eviction' events
+    """
+
+    def __init__(self, max_nbytes, listener=None):
+        self._max_nbytes = int(max_nbytes)
+        self._listener = listener
+        self._entries = _OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        '''Get a value and mark it as the most recently used
+        '''
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self._misses += 1
+                value, size = default, 0
+                event = 'miss'
+            else:
+                self._entries[key] = (value, size)
+                self._hits += 1
+                event = 'hit'
+        if self._listener is not None:
+            self._listener(event, key, size)
+        return value
+
+    def peek(self, key, default=None):
+        '''Get a value without changing the order or the counters
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def put(self, key, value, size=None):
+        '''Store a value, evict the least recently used values to fit the budget
+
+        :param key: hashable key
+        :param value: value to store
+        :param size: size in bytes, determined from the value by default
+        :return: True if the value has been stored
+        '''
+        if size is None:
+            size = nbytes(value)
+        with self._lock:
+            self.pop(key)
+            if size > self._max_nbytes:
+                return False
+            self._entries[key] = (value, size)
+            self._nbytes += size
+            self._evict()
+            return True
+
+    def pop(self, key, default=None):
+        '''Remove a value from the cache
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._nbytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        '''Remove all values
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def set_limit(self, max_nbytes):
+        '''Change the maximum total size, evict values if necessary
+        '''
+        with self._lock:
+            self._max_nbytes = int(max_nbytes)
+            self._evict()
+
+    @property
+    def max_nbytes(self):
+        '''Maximum total size of the cached values in bytes
+        '''
+        return self._max_nbytes
+
+    def info(self):
+        '''Cache statistics as a CacheInfo named tuple
+        '''
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions,
+                             self._nbytes, self._max_nbytes, len(self._entries))
+
+    def _evict(self):
+        while self._nbytes > self._max_nbytes:
+            key, (_, size) = self._entries.popitem(last=False)
+            self._nbytes -= size
+            self._evictions += 1
+            if self._listener is not None:
+                self._listener('eviction', key, size)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,119 @@
+'''Pool of open read-only files shared by lazy data sets
+'''
+
+from pydons import _OrderedDict
+import os
+import threading
+
+
+class _PoolEntry(object):
+    """Open file with the resolved data set objects"""
+
+    def __init__(self, fileobj, stat):
+        self.fileobj = fileobj
+        self.stat = stat
+        self.items = {}
+
+
+def _stat(path):
+    '''File identification used for staleness detection
+    '''
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _isopen(fileobj):
+    if hasattr(fileobj, '_isopen'):
+        # netCDF4
+        return bool(fileobj._isopen)
+    return bool(fileobj.id.valid)
+
+
+class FilePool(object):
+    """Least-recently-used pool of open read-only files keyed by the absolute path
+
+    Files are reopened if they have been closed or modified (detected by the inode,
+    size and modification time). The resolved data set and group objects are cached
+    per open file.
+
+    :param max_open: maximum number of open files
+    :param lock: reentrant lock held while the pool is used or files are closed,
+        the objects from the pool are valid only while the same lock is held
+    """
+
+    def __init__(self, max_open=128, lock=None):
+        self._max_open = int(max_open)
+        self._entries = _OrderedDict()
+        self._lock = threading.RLock() if lock is None else lock
+
+    def _entry(self, fileclass, path):
+        path = os.path.abspath(path)
+        key = (fileclass, path)
+        stat = _stat(path)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry.stat != stat or not _isopen(entry.fileobj)):
+                self._close(entry)
+                entry = None
+            if entry is None:
+                entry = _PoolEntry(fileclass(path, 'r'), stat)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_open:
+                _, evicted = self._entries.popitem(last=False)
+                self._close(evicted)
+            return entry
+
+    def open(self, fileclass, path):
+        '''Get an open file
+
+        :param fileclass: file class (h5py.File or NC4File)
+        :param path: file path
+        '''
+        return self._entry(fileclass, path).fileobj
+
+    def get(self, fileclass, path, name):
+        '''Get a data set or group object from an open file
+
+        :param fileclass: file class (h5py.File or NC4File)
+        :param path: file path
+        :param name: absolute path of the object in the file
+        '''
+        return self.lookup(fileclass, path, name)[0]
+
+    def lookup(self, fileclass, path, name):
+        '''Get a data set or group object and the identification of the open file
+
+        :return: (object, (inode, size, modification time))
+        '''
+        with self._lock:
+            entry = self._entry(fileclass, path)
+            item = entry.items.get(name)
+            if item is None:
+                item = entry.items[name] = entry.fileobj[name]
+            return item, entry.stat
+
+    def close(self, path=None):
+        '''Close a file (all files if path is None)
+        '''
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if path is None or key[1] == os.path.abspath(path):
+                    self._close(self._entries.pop(key))
+
+    def set_max_open(self, max_open):
+        '''Set the maximum number of open files, close the least recently used ones
+        '''
+        with self._lock:
+            self._max_open = int(max_open)
+            while len(self._entries) > self._max_open:
+                _, evicted = self._entries.popitem(last=False)
+                self._close(evicted)
+
+    @staticmethod
+    def _close(entry):
+        entry.items.clear()
+        if _isopen(entry.fileobj):
+            entry.fileobj.close()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,8 +1,8 @@
-from hdf5storage.Marshallers import TypeMarshaller
+from hdf5storage.Marshallers import TypeMarshaller, NumpyScalarArrayMarshaller
 # import pydons
 import h5py
 import six
-import distutils
+import distutils.version
 
 # Ubuntu 12.04's h5py doesn't have __version__ set so we need to try to
 # grab the version and if it isn't available, just assume it is 2.0.
@@ -18,8 +18,10 @@ from hdf5storage.lowlevel import write_data, read_data
 
 
 class MatStructMarshaller(TypeMarshaller):
-    def __init__(self, MatStructType):
+    def __init__(self, MatStructType, MatStructArrayType=None):
         TypeMarshaller.__init__(self)
+        # Matlab struct arrays (multi-element structs) are read as MatStructArrayType
+        self.__struct_array = MatStructArrayType and MatStructArrayMarshaller(MatStructArrayType)
         self.python_attributes |= set(['Python.Fields'])
         self.matlab_attributes |= set(['MATLAB_class'])
         self.types = [MatStructType, dict]
@@ -140,6 +142,12 @@ class MatStructMarshaller(TypeMarshaller):
             raise NotImplementedError('No Group ' + name +
                                       ' is present.')
 
+        # Multi-element Matlab structs have Reference arrays to all the
+        # values as fields, the same condition as in hdf5storage's
+        # NumpyScalarArrayMarshaller.
+        if self.__struct_array is not None and _is_struct_array(grp[name], options):
+            return self.__struct_array.read(f, grp, name, options)
+
         # Starting with an empty dict, all that has to be done is
         # iterate through all the Datasets and Groups in grp[name] and
         # add them to the dict with their name as the key. Since we
@@ -157,3 +165,43 @@ class MatStructMarshaller(TypeMarshaller):
             except:
                 pass
         return data
+
+
+class MatStructArrayMarshaller(NumpyScalarArrayMarshaller):
+    def __init__(self, MatStructArrayType):
+        NumpyScalarArrayMarshaller.__init__(self)
+        self.types = [MatStructArrayType]
+        self.python_type_strings = ['{}.{}'.format(MatStructArrayType.__module__,
+                                                   MatStructArrayType.__name__)]
+        # Matlab structs are handled by MatStructMarshaller
+        self.matlab_classes = []
+
+    def write(self, f, grp, name, data, type_string, options):
+        # Written as a structured ndarray in the Group/struct layout (a
+        # Matlab struct array), which can hold object fields and can be
+        # written to the root group.
+        as_struct = options.structured_numpy_ndarray_as_struct
+        options.structured_numpy_ndarray_as_struct = True
+        try:
+            NumpyScalarArrayMarshaller.write(self, f, grp, name,
+                                             data.to_records(),
+                                             self.get_type_string(data,
+                                             type_string), options)
+        finally:
+            options.structured_numpy_ndarray_as_struct = as_struct
+
+    def read(self, f, grp, name, options):
+        data = NumpyScalarArrayMarshaller.read(self, f, grp, name,
+                                               options)
+        return self.types[0].from_records(data)
+
+
+def _is_struct_array(grp, options):
+    '''Check if a group is a multi-element struct (all fields are Reference arrays)
+    '''
+    fields = [fld for fld in grp.values() if fld.name != options.group_for_references]
+    for fld in fields:
+        if isinstance(fld, h5py.Group) or h5py.check_dtype(ref=fld.dtype) is None \
+                or set(fld.attrs.keys()) - set(['H5PATH', 'MATLAB_empty', 'Python.Empty']):
+            return False
+    return bool(fields)
@@ -0,0 +1,118 @@
+'''Cache and I/O counters of lazy data sets
+
+Events are recorded into the process-wide counters (GLOBAL) and into all
+counters activated by the collect context manager. Hooks registered by
+add_hook are called for every event, e.g. logging_hook logs them.
+'''
+
+import contextlib
+import logging
+import threading
+
+
+logger = logging.getLogger('pydons')
+
+
+class Counters(object):
+    """Cache and I/O counters
+
+    * hits, misses, evictions: global cache events
+    * reads, read_bytes, read_time: reads from the files (bytes after decompression, seconds)
+    * datasets: per data set read statistics, (file path, data set path) ->
+      [reads, bytes, total time, maximum time]
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Set all counters to zero
+        '''
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reads = 0
+        self.read_bytes = 0
+        self.read_time = 0.0
+        self.datasets = {}
+
+    def _cache_event(self, event):
+        if event == 'hit':
+            self.hits += 1
+        elif event == 'miss':
+            self.misses += 1
+        elif event == 'eviction':
+            self.evictions += 1
+
+    def _read_event(self, filepath, path, nbytes, seconds):
+        self.reads += 1
+        self.read_bytes += nbytes
+        self.read_time += seconds
+        item = self.datasets.get((filepath, path))
+        if item is None:
+            self.datasets[(filepath, path)] = [1, nbytes, seconds, seconds]
+        else:
+            item[0] += 1
+            item[1] += nbytes
+            item[2] += seconds
+            item[3] = max(item[3], seconds)
+
+
+GLOBAL = Counters()
+_active = [GLOBAL]
+_hooks = []
+_lock = threading.Lock()
+
+
+def cache_event(event, key, nbytes):
+    '''Record a cache event ('hit', 'miss' or 'eviction')
+    '''
+    with _lock:
+        for counters in _active:
+            counters._cache_event(event)
+    for hook in list(_hooks):
+        hook(event, key=key, nbytes=nbytes)
+
+
+def read_event(filepath, path, nbytes, seconds):
+    '''Record a read from a file
+    '''
+    with _lock:
+        for counters in _active:
+            counters._read_event(filepath, path, nbytes, seconds)
+    for hook in list(_hooks):
+        hook('read', filepath=filepath, path=path, nbytes=nbytes, seconds=seconds)
+
+
+@contextlib.contextmanager
+def collect():
+    '''Context manager collecting the events of a block of code into new Counters
+
+    The counters are process-wide, i.e. they include events from other threads.
+    '''
+    counters = Counters()
+    with _lock:
+        _active.append(counters)
+    try:
+        yield counters
+    finally:
+        with _lock:
+            _active.remove(counters)
+
+
+def add_hook(hook):
+    '''Register a function called as hook(event, **info) for each event
+    '''
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    '''Unregister a hook function
+    '''
+    _hooks.remove(hook)
+
+
+def logging_hook(event, **info):
+    '''Hook logging the events to the "pydons" logger at the DEBUG level
+    '''
+    logger.debug('%s %s', event, ' '.join('%s=%s' % item for item in sorted(info.items())))
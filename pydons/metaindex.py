@@ -0,0 +1,124 @@
+'''Persistent index of the file structure and metadata read by FileBrowser
+
+The index is a pickled metadata tree stored in the user cache directory or in
+a given index directory. It is valid while the size and the modification time
+of the data file do not change, i.e. it is meant for files that are not
+modified in place. As unpickling can run code, only index files owned by the
+current user and not writable by others are loaded.
+'''
+
+import hashlib
+import os
+import six
+import stat
+from six.moves import cPickle as pickle
+
+
+VERSION = 1
+SUFFIX = '.pydons-index'
+
+
+def cache_dir():
+    '''Default index directory, $XDG_CACHE_HOME/pydons or ~/.cache/pydons
+    '''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pydons')
+
+
+def _cache_path(filepath, directory):
+    digest = hashlib.sha1(filepath.encode('utf8')).hexdigest()
+    return os.path.join(directory, digest + SUFFIX)
+
+
+def index_paths(filepath, location=True):
+    '''Candidate index file paths in the order of preference
+
+    :param filepath: absolute path of the data file
+    :param location: True for the user cache directory, or an index directory
+    '''
+    if isinstance(location, six.string_types):
+        return [_cache_path(filepath, location)]
+    return [_cache_path(filepath, cache_dir())]
+
+
+def file_key(filepath):
+    '''Identification of the data file content: (path, size, modification time)
+    '''
+    st = os.stat(filepath)
+    return (filepath, st.st_size, st.st_mtime)
+
+
+def _trusted(fobj):
+    '''Check that an open index file is owned by the current user and not writable by others
+    '''
+    if not hasattr(os, 'getuid'):
+        # no POSIX ownership (Windows), the index directory must be private
+        return True
+    st = os.fstat(fobj.fileno())
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load(filepath, kind, location=True):
+    '''Load the metadata tree if a fresh index exists
+
+    :param filepath: absolute path of the data file
+    :param kind: file type identification (the index is specific to the reader)
+    :param location: see index_paths
+    :return: metadata tree or None
+    '''
+    key = file_key(filepath)
+    for path in index_paths(filepath, location):
+        try:
+            with open(path, 'rb') as fobj:
+                if not _trusted(fobj):
+                    continue
+                header = pickle.load(fobj)
+                if header != (VERSION, kind, key):
+                    continue
+                return pickle.load(fobj)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, IndexError, pickle.UnpicklingError):
+            # missing, unreadable or corrupted index
+            continue
+    return None
+
+
+def save(filepath, kind, tree, location=True):
+    '''Store the metadata tree, failures to write or pickle the index are ignored
+
+    :param filepath: absolute path of the data file
+    :param kind: file type identification
+    :param tree: metadata tree
+    :param location: see index_paths
+    :return: index file path or None if it could not be written
+    '''
+    key = file_key(filepath)
+    for path in index_paths(filepath, location):
+        directory = os.path.dirname(path)
+        tmppath = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            # private file, not writable by others whatever the umask is
+            fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as fobj:
+                # the header is checked before the tree is unpickled
+                pickle.dump((VERSION, kind, key), fobj, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(tree, fobj, pickle.HIGHEST_PROTOCOL)
+            # atomic replacement, concurrent readers see either the old or the new index
+            getattr(os, 'replace', os.rename)(tmppath, path)
+            return path
+        except (IOError, OSError):
+            _remove(tmppath)
+        except (pickle.PicklingError, TypeError, AttributeError, ValueError):
+            # the tree cannot be pickled, no index is written
+            _remove(tmppath)
+            return None
+    return None
@@ -0,0 +1,151 @@
+'''Translation of NumPy-style selections into on-disk hyperslab reads
+'''
+
+import itertools
+import numbers
+import numpy as np
+
+
+def hyperslab(key, shape):
+    '''Split a NumPy-style selection into a hyperslab and a post-read selection
+
+    The hyperslab is a tuple of slices with positive steps, one per axis, that
+    HDF5 and netCDF4 can read directly. Applying the post-read selection to the
+    block read from the hyperslab gives the same result as ``data[key]``.
+
+    :param key: index (integers, slices, Ellipsis, None, integer or boolean arrays)
+    :param shape: shape of the indexed data
+    :return: (block, post) tuple or None if the selection cannot be translated
+    '''
+    if not shape:
+        return None
+    if not isinstance(key, tuple):
+        key = (key, )
+    # boolean arrays are equivalent to the integer arrays from nonzero()
+    items = []
+    for k in key:
+        if isinstance(k, (np.ndarray, list)):
+            k = np.asarray(k)
+            if k.dtype.kind == 'b':
+                if k.ndim == 0:
+                    return None
+                items.extend(np.nonzero(k))
+                continue
+        items.append(k)
+    nexplicit = len([k for k in items if k is not None and k is not Ellipsis])
+    if nexplicit > len(shape):
+        raise IndexError('too many indices for array')
+    block = []
+    post = []
+    axis = 0
+    ellipsis = False
+    for k in items:
+        if k is None:
+            post.append(None)
+            continue
+        if k is Ellipsis:
+            if ellipsis:
+                raise IndexError("an index can only have a single ellipsis ('...')")
+            ellipsis = True
+            for _ in range(len(shape) - nexplicit):
+                block.append(slice(0, shape[axis], 1))
+                post.append(slice(None))
+                axis += 1
+            continue
+        n = shape[axis]
+        if isinstance(k, numbers.Integral) and not isinstance(k, (bool, np.bool_)):
+            i = int(k)
+            if i < -n or i >= n:
+                raise IndexError('index %d is out of bounds for axis %d with size %d' % (i, axis, n))
+            if i < 0:
+                i += n
+            block.append(slice(i, i + 1, 1))
+            post.append(0)
+        elif isinstance(k, slice):
+            start, stop, step = k.indices(n)
+            count = len(range(start, stop, step))
+            last = start + (count - 1) * step
+            if count == 0:
+                block.append(slice(0, 0, 1))
+                post.append(slice(None))
+            elif step > 0:
+                block.append(slice(start, last + 1, step))
+                post.append(slice(None))
+            else:
+                block.append(slice(last, start + 1, -step))
+                post.append(slice(None, None, -1))
+        else:
+            k = np.asarray(k)
+            if k.dtype.kind not in 'iu':
+                return None
+            if k.size and (k.min() < -n or k.max() >= n):
+                raise IndexError('index out of bounds for axis %d with size %d' % (axis, n))
+            k = np.where(k < 0, k + n, k)
+            if k.size == 0:
+                block.append(slice(0, 0, 1))
+                post.append(k)
+            else:
+                lo = int(k.min())
+                block.append(slice(lo, int(k.max()) + 1, 1))
+                post.append(k - lo)
+        axis += 1
+    for n in shape[axis:]:
+        block.append(slice(0, n, 1))
+        post.append(slice(None))
+    return tuple(block), tuple(post)
+
+
+def is_full(block, shape):
+    '''Check if a hyperslab covers the whole data
+
+    :param block: tuple of slices as returned by hyperslab
+    :param shape: shape of the data
+    '''
+    return all(s.start == 0 and s.stop == n and (s.step == 1 or n <= 1)
+               for s, n in zip(block, shape))
+
+
+def is_trivial(post):
+    '''Check if a post-read selection returns the block unchanged
+    '''
+    return all(isinstance(p, slice) and p == slice(None) for p in post)
+
+
+def chunk_grid(block, chunks, shape):
+    '''Split a hyperslab into the parts falling into individual chunks
+
+    :param block: tuple of slices as returned by hyperslab
+    :param chunks: chunk shape
+    :param shape: data shape
+    :return: generator of (coords, chunk, src, dst) tuples, where coords are the chunk
+        grid coordinates, chunk is the chunk extent (tuple of slices), src is the selection
+        within the chunk and dst is the destination in the block read
+    '''
+    axes = []
+    for s, c, n in zip(block, chunks, shape):
+        parts = []
+        stop = min(s.stop, n)
+        if s.start < stop:
+            last = s.start + (len(range(s.start, stop, s.step)) - 1) * s.step
+            for k in range(s.start // c, last // c + 1):
+                lo, hi = k * c, min((k + 1) * c, n)
+                # first selected index in the chunk
+                first = s.start + max(0, -(-(lo - s.start) // s.step)) * s.step
+                end = min(hi, stop)
+                if first >= end:
+                    continue
+                count = len(range(first, end, s.step))
+                dst = (first - s.start) // s.step
+                parts.append((k, slice(lo, hi),
+                              slice(first - lo, end - lo, s.step),
+                              slice(dst, dst + count)))
+        axes.append(parts)
+    for combination in itertools.product(*axes):
+        coords, chunk, src, dst = zip(*combination) if combination else ((), (), (), ())
+        yield coords, chunk, src, dst
+
+
+def block_shape(block):
+    '''Shape of the data read from a hyperslab
+    '''
+    return tuple(len(range(s.start, s.stop, s.step)) for s in block)
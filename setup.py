@@ -8,6 +8,11 @@ ez_setup.use_setuptools()
 
 from setuptools import setup
 
+install_requires = ['numpy', 'h5py>=2.1', 'hdf5storage', 'six']
+if sys.version_info < (3, 2):
+    # concurrent.futures backport (thread pools for prefetching and parallel reads)
+    install_requires.append('futures')
+
 with open('README.rst') as file:
     long_description = file.read()
 
@@ -19,7 +24,7 @@ setup(name='pydons',
       author_email='coobas at gmail dt com',
       url='https://bitbucket.org/urbanj/pydons',
       packages=['pydons'],
-      install_requires=['numpy', 'h5py>=2.1', 'hdf5storage', 'six'],
+      install_requires=install_requires,
       extras_require={'netCDF4': ['netCDF4']},
       # requires=requires,
       license='MIT',
@@ -0,0 +1,47 @@
+from pydons import MatStruct, FileBrowser, LazyDataset
+import pydons.aio
+import asyncio
+import numpy as np
+import tempfile
+
+
+def test_aread():
+    d = MatStruct()
+    d.field_a = np.random.rand(100, 3)
+    d.group = MatStruct()
+    d.group.field_b = np.random.rand(20)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        d.saveh5(tmpf.name)
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+        reads = []
+        _get_data = LazyDataset._get_data
+
+        def counted_get_data(self, key=None):
+            reads.append(key)
+            return _get_data(self, key)
+
+        async def main():
+            LazyDataset._get_data = counted_get_data
+            try:
+                res = await asyncio.gather(*([dd.field_a.aread((slice(10, 20), 1))] * 5 +
+                                             [dd.field_a.aread(slice(10, 20))]))
+                many = await dd.aread_many(['/field_a', dd.group.field_b])
+            finally:
+                LazyDataset._get_data = _get_data
+            return res, many
+
+        res, many = asyncio.run(main())
+        assert all(np.all(r == d.field_a[10:20, 1]) for r in res[:5])
+        assert np.all(res[5] == d.field_a[10:20])
+        # the same selections are coalesced
+        assert len(reads) == 4
+        assert np.all(many[0] == d.field_a)
+        assert np.all(many[1] == d.group.field_b)
+
+
+def test_set_max_workers():
+    pydons.aio.set_max_workers(2)
+    assert pydons.aio._get_executor()._max_workers == 2
+    pydons.aio.set_max_workers(4)
@@ -22,3 +22,18 @@ def test_var_a():
         assert fb.r.attrs.a_num == 1
         assert np.all(fb.r.attrs.a_arr == 1)
         assert fb.r.attrs['_hidden']
+
+
+def test_lazy_attrs():
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        file_name = tmpf.name
+        with h5py.File(file_name, 'w') as fh:
+            dset = fh.create_dataset('r', data=np.random.rand(3, 4))
+            dset.attrs.create('a_num', 1)
+
+        fb = FileBrowser(file_name)
+        # attributes are not read while browsing
+        assert fb.r._attrs is None
+        assert isinstance(fb.r.attrs, MatStruct)
+        assert fb.r.attrs.a_num == 1
+        assert fb.r.attrs is fb.r.attrs
@@ -1,4 +1,4 @@
-from pydons import MatStruct
+from pydons import MatStruct, MatStructArray
 import numpy as np
 import unittest
 from pydons import _OrderedDict as OrderedDict
@@ -41,3 +41,144 @@ def test_dedict():
     assert isinstance(ms['z'], MatStruct)
     ms = MatStruct(od, dedict=False)
     assert isinstance(ms['z'], OrderedDict)
+
+
+def test_dir():
+    d = MatStruct(any_keys=True)
+    d.zeta = 1
+    d.alpha = 2
+    d[1] = 3
+    names = dir(d)
+    assert names == sorted(names)
+    assert 'zeta' in names and 'alpha' in names and 'keys' in names
+    d.beta = 4
+    del d.zeta
+    assert 'beta' in dir(d) and 'zeta' not in dir(d)
+    # methods bypassing __delitem__
+    d.pop('alpha')
+    d.popitem()
+    assert 'alpha' not in dir(d) and 'beta' not in dir(d)
+    d.gamma = 5
+    d.clear()
+    assert 'gamma' not in dir(d)
+    # copies do not share the attribute names
+    import copy
+    d.delta = 6
+    c = copy.copy(d)
+    c.epsilon = 7
+    assert 'epsilon' not in dir(d)
+    assert 'delta' in dir(c)
+
+
+def test_from_items():
+    items = [('a', 1), ('b', {'c': 2, 'd': {'e': 3}}), ('f', OrderedDict([('g', 4)]))]
+    for validate in ('fast', 'none'):
+        ms = MatStruct.from_items(items, validate=validate)
+        assert list(ms.keys()) == ['a', 'b', 'f']
+        assert isinstance(ms.b, MatStruct)
+        assert ms.b.d.e == 3
+        assert ms.f.g == 4
+        assert 'a' in dir(ms) and 'c' in dir(ms.b)
+    ms = MatStruct.from_items(OrderedDict(items), dedict=False)
+    assert not isinstance(ms.b, MatStruct)
+    assert MatStruct.from_items(MatStruct(items)) == MatStruct(items)
+
+
+def test_key_validation():
+    for key, message in (('1a', 'alphabetic'), ('a-b', 'alphanumeric'), (u'áb', 'ascii'),
+                         ('keys', 'method'), ('', 'empty'), (1, 'strings')):
+        for create in (MatStruct, MatStruct.from_items):
+            try:
+                create([(key, None)])
+                assert False
+            except KeyError as e:
+                assert message in str(e)
+    # any keys in the constructor
+    ms = MatStruct([('1a', 1), ('keys', 2)], any_keys=True)
+    assert list(ms.keys()) == ['1a', 'keys']
+    assert '1a' not in dir(ms)
+
+
+def test_struct_array():
+    structs = [MatStruct([('x', float(i)), ('v', np.arange(3) + i)]) for i in range(4)]
+    arr = MatStructArray.from_structs(structs)
+
+    assert arr.shape == (4, )
+    assert len(arr) == 4
+    assert arr.fields == ['x', 'v']
+    assert arr.x.dtype == np.float64
+    assert arr.v.shape == (4, 3)
+    assert np.all(arr['v'][2] == structs[2].v)
+
+    # single elements are views
+    item = arr[1]
+    assert isinstance(item, MatStruct)
+    assert item.x == 1.0
+    item.x = 10.0
+    assert arr.x[1] == 10.0
+    np.testing.assert_raises(KeyError, item.__setitem__, 'new', 1)
+
+    # boolean and fancy indexing
+    sub = arr[arr.x > 1]
+    assert isinstance(sub, MatStructArray)
+    assert list(sub.x) == [10.0, 2.0, 3.0]
+    assert list(arr[[3, 0]].x) == [3.0, 0.0]
+    assert list(arr[::2].x) == [0.0, 2.0]
+
+    # new column broadcast to the shape
+    arr.flag = False
+    assert arr.flag.shape == (4, )
+    arr[0] = MatStruct([('x', -1.0), ('v', np.zeros(3)), ('flag', True)])
+    assert arr.x[0] == -1.0 and arr.flag[0]
+
+    # ragged fields are stored in object columns
+    ragged = MatStructArray.from_structs([MatStruct([('v', np.arange(n))]) for n in (1, 2)])
+    assert ragged.v.dtype == object
+    assert np.all(ragged[1].v == np.arange(2))
+    ragged = MatStructArray([('v', [np.arange(1), np.arange(2)])])
+    assert ragged.shape == (2, ) and ragged.v.dtype == object
+    ragged.w = [np.arange(3), np.arange(4)]
+    assert np.all(ragged[1].w == np.arange(4))
+
+    records = arr.to_records()
+    assert records.dtype.names == ('x', 'v', 'flag')
+    assert np.all(MatStructArray.from_records(records).v == arr.v)
+    assert [s.x for s in arr.to_structs()] == list(arr.x)
+
+
+def test_merge():
+    x = np.arange(3.)
+    a = MatStruct([('x', x), ('s', MatStruct([('y', 1.0)]))])
+    b = {'x': np.arange(2.), 's': {'y': 2.0, 'z': 'b'}, 'w': {'q': 1}}
+
+    # new fields share the values, the inputs are not modified
+    d = MatStruct().merge(a)
+    assert d.x is x
+    assert d.s is not a.s
+    d.merge(b)
+    assert isinstance(d.w, MatStruct)
+    assert d.s.y == 2.0 and d.s.z == 'b'
+    assert list(a.s.keys()) == ['y'] and a.s.y == 1.0
+
+    assert MatStruct().merge(a, b, conflict='keep').x is x
+    # structs replacing other values are new too
+    d = MatStruct([('s', 1)])
+    d.merge(a)
+    d.merge({'s': {'y': 2}})
+    assert list(a.s.keys()) == ['y'] and a.s.y == 1.0
+    d = MatStruct([('s', 1)])
+    d.merge(a, conflict='keep')
+    assert d.s == 1
+    np.testing.assert_raises(KeyError, MatStruct().merge, a, b, conflict='raise')
+    np.testing.assert_raises(ValueError, MatStruct().merge, a, conflict='append')
+
+    # many structs concatenated at once
+    parts = [MatStruct([('t', np.arange(i, i + 2)), ('s', MatStruct([('v', np.ones((2, 3)) * i)])),
+                        ('n', i)])
+             for i in range(4)]
+    m = MatStruct().merge(*parts, conflict='concatenate')
+    assert np.all(m.t == np.concatenate([p.t for p in parts]))
+    assert m.s.v.shape == (8, 3)
+    assert list(m.n) == [0, 1, 2, 3]
+    m = MatStruct().merge(*[p.s for p in parts], conflict='concatenate', axis=1)
+    assert m.v.shape == (2, 12)
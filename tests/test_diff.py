@@ -1,4 +1,5 @@
-from pydons import MatStruct
+from pydons import MatStruct, FileBrowser
+import tempfile
 import numpy as np
 import random
 
@@ -67,3 +68,50 @@ def test_diff_small_numbers():
     assert ddiff.diff_norm == (ddiff.int + ddiff.float) / 2
     assert ddiff.diff_max == max(ddiff.int, ddiff.float)
     assert ddiff.diff_uncomparable == 0
+
+
+def test_diff_nan():
+    d = MatStruct([('a', np.array([1., np.nan, 3.]))])
+    dd = MatStruct([('a', np.array([1., np.nan, 4.]))])
+
+    assert np.isnan(d.diff(dd).a)
+    assert d.diff(dd, nan='equal').a == 1 / np.sqrt(10)
+    dd.a[1] = 2.
+    assert d.diff(dd, nan='equal').a == np.inf
+    assert d.diff(dd, nan='ignore').a == 1 / np.sqrt(10)
+
+
+def test_diff_lazy():
+    d = MatStruct()
+    d.a = np.random.rand(1000, 20)
+    d.g = MatStruct()
+    d.g.b = np.arange(5000.)
+    dd = MatStruct()
+    dd.a = d.a + 1e-3 * np.random.rand(1000, 20)
+    dd.g = MatStruct()
+    dd.g.b = d.g.b.copy()
+    dd.g.b[-1] += 100
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf1, \
+            tempfile.NamedTemporaryFile(suffix=".h5") as tmpf2:
+        d.saveh5(tmpf1.name)
+        dd.saveh5(tmpf2.name)
+        fb1 = FileBrowser(tmpf1.name, lazy_max_size=10)
+        fb2 = FileBrowser(tmpf2.name, lazy_max_size=10)
+
+        expected = d.diff(dd)
+        for kwargs in ({}, {'max_workers': 4, 'block_nbytes': 4096}):
+            ddiff = fb1.diff(fb2, **kwargs)
+            assert ddiff.diff_uncomparable == 0
+            assert np.isclose(ddiff.a, expected.a)
+            assert np.isclose(ddiff.g.b, expected.g.b)
+            assert np.isclose(ddiff.diff_norm, expected.diff_norm)
+            # the data sets are not loaded
+            assert fb1.a._data is None and fb2.g.b._data is None
+
+        # mixed in-memory and lazy values
+        assert np.isclose(d.diff(fb2).a, expected.a)
+
+        ddiff = fb1.diff(fb2, tol=1, block_nbytes=4096)
+        assert ddiff.g.b == np.inf
+        assert np.isclose(ddiff.a, expected.a)
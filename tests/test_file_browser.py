@@ -1,7 +1,12 @@
 from pydons import MatStruct, FileBrowser, LazyDataset
+import pydons.selection
+import pydons.metaindex
 import numpy as np
 import tempfile
+import shutil
 import os
+import h5py
+import threading
 
 
 DATADIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -91,29 +96,587 @@ def test_global_cache():
     field_c = np.random.rand(10000)
 
     d.field_a = field_a
-    d.field_aa = field_a
+    d.field_aa = field_a.astype(np.int8)
     d.field_b = field_b
     d.field_c = field_c
 
-    LazyDataset.MAX_CACHE_SIZE = field_b.size
+    cache_limit = LazyDataset.cache_info().max_nbytes
     LazyDataset._clear_cache()
+    LazyDataset.set_cache_limit(field_b.nbytes + field_a.nbytes)
+
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+            d.saveh5(tmpf.name)
+
+            dd = FileBrowser(tmpf.name, lazy_min_size=field_a.size,
+                             lazy_max_size=field_b.size)
+
+            # small arrays are cached, the cache size is in bytes
+            assert all(f._data is not None for f in dd.values() if f.size <= field_a.size)
+            assert all(f._data is None for f in dd.values() if f.size > field_a.size)
+            assert LazyDataset.cache_info().nbytes == field_a.nbytes + field_a.size
+            assert LazyDataset.cache_info().entries == 2
+            # a hit promotes field_a, field_aa is the least recently used
+            dd.field_a[:]
+            dd.field_b[:]
+            assert dd.field_b._data is not None
+            assert dd.field_a._data is not None
+            assert dd.field_aa._data is None
+            assert LazyDataset.cache_info().nbytes == field_b.nbytes + field_a.nbytes
+            assert LazyDataset.cache_info().evictions == 1
+            # field_c is too large to be cached
+            dd.field_c[:]
+            assert dd.field_c._data is None
+            # deleted objects are removed from the cache
+            del dd.field_b
+            assert LazyDataset.cache_info().nbytes == field_a.nbytes
+            LazyDataset.set_cache_limit(0)
+            assert LazyDataset.cache_info().entries == 0
+    finally:
+        LazyDataset.set_cache_limit(cache_limit)
+
+
+def test_partial_read():
+    d = MatStruct()
+    d.field_a = np.random.rand(20, 30, 4)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        d.saveh5(tmpf.name)
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+
+        keys = (5, -1, slice(2, 17, 3), slice(None, None, -2), Ellipsis,
+                (Ellipsis, 1), (1, slice(None), -2), (None, 3, slice(4, 1, -1)),
+                (slice(None), [1, 5, 3]), (np.arange(20) % 3 == 0, 2),
+                (slice(5, 5), 0), ([2, 4], [1, 7], slice(1, 3)))
+        for key in keys:
+            assert np.all(dd.field_a[key] == d.field_a[key])
+            assert dd.field_a[key].shape == d.field_a[key].shape
+        assert dd.field_a._data is None
+        try:
+            dd.field_a[20]
+        except IndexError:
+            pass
+        else:
+            raise AssertionError('IndexError not raised')
+
+
+def test_chunk_cache():
+    data = np.random.rand(100, 7)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh.create_dataset('signal', data=data, chunks=(16, 3), compression='gzip')
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+        assert dd.signal._chunks == (16, 3)
+
+        keys = ((slice(10, 40), 2), (slice(20, 50), slice(None)),
+                (slice(None, None, 7), slice(1, None, 4)), (slice(95, 20, -3), [0, 6]))
+        for key in keys:
+            assert np.all(dd.signal[key] == data[key])
+            assert dd.signal[key].shape == data[key].shape
+        # overlapping windows are served from the cached chunks
+        info = LazyDataset.cache_info()
+        assert np.all(dd.signal[30:45, :] == data[30:45, :])
+        assert LazyDataset.cache_info().hits - info.hits == 6
+        assert LazyDataset.cache_info().misses == info.misses
+
+        # chunks of a rewritten file are not served from the cache
+        LazyDataset.close_files(tmpf.name)
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh.create_dataset('signal', data=data + 1, chunks=(16, 3), compression='gzip')
+        os.utime(tmpf.name, (0, 0))
+        assert np.all(dd.signal[30:45, :] == data[30:45, :] + 1)
+        assert np.all(FileBrowser(tmpf.name, lazy_max_size=10).signal[30:45, :] ==
+                      data[30:45, :] + 1)
+
+
+def test_mmap():
+    data = np.random.rand(6, 5)
+
+    with tempfile.NamedTemporaryFile(suffix=".mat") as tmpf:
+        with h5py.File(tmpf.name, 'w', userblock_size=512) as fh:
+            fh.create_dataset('contiguous', data=data)
+            fh.create_dataset('chunked', data=data, chunks=(2, 5), compression='gzip')
+
+        # .mat files are transposed by default
+        dd = FileBrowser(tmpf.name, mmap=True)
+
+        assert isinstance(dd.contiguous[:], np.memmap)
+        assert not dd.contiguous[:].flags.writeable
+        assert dd.contiguous.shape == data.T.shape
+        assert np.all(dd.contiguous[:] == data.T)
+        assert np.all(dd.contiguous[1:4, ::2] == data.T[1:4, ::2])
+        assert not isinstance(dd.chunked[:], np.memmap)
+        assert np.all(dd.chunked[:] == data.T)
+
+
+def test_prefetch():
+    d = MatStruct()
+    d.group = MatStruct()
+    for i in range(20):
+        d['signal%d' % i] = np.random.rand(50 + i)
+        d.group['signal%d' % i] = np.random.rand(3, 30 + i)
 
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            for key, value in d.items():
+                if key != 'group':
+                    fh.create_dataset(key, data=value)
+            for key, value in d.group.items():
+                fh.create_dataset('group/' + key, data=value, chunks=(1, 8),
+                                  compression='gzip', shuffle=True)
+
+        dd = FileBrowser(tmpf.name)
+        data = dd.prefetch(max_workers=4)
+        assert len(data) == 40
+        assert all(dataset._data is not None for dataset in dd.group.values())
+        assert np.all(dd.group.signal3._data == d.group.signal3)
+
+        paths = ['/group/signal%d' % i for i in range(20)] + [dd.signal0]
+        data = dd.prefetch(paths, max_workers=4)
+        assert np.all(data[5] == d.group.signal5)
+        assert np.all(data[-1] == d.signal0)
+
+        # concurrent partial reads of the same data sets
+        dd = FileBrowser(tmpf.name, lazy_max_size=0)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: dd.group['signal%d' % (i % 20)][1, i % 7::3],
+                                        range(200)))
+        for i, res in enumerate(results):
+            assert np.all(res == d.group['signal%d' % (i % 20)][1, i % 7::3])
+
+
+def test_file_pool():
+    d = MatStruct()
+    for i in range(10):
+        d['field%d' % i] = np.random.rand(100)
+    d.scalar = 1.
+    d.group = MatStruct([('small', np.arange(3.))])
+
+    LazyDataset.close_files()
     with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
         d.saveh5(tmpf.name)
 
-        dd = FileBrowser(tmpf.name, lazy_min_size=field_a.size,
-                         lazy_max_size=LazyDataset.MAX_CACHE_SIZE)
-
-        # test if small size arrays are cached
-        cache_size = sum(f.size for f in dd.values() if f.size <= field_a.size)
-        assert all(f._LazyDataset__global_cache for f in dd.values() if f.size <= field_a.size)
-        assert all(~f._LazyDataset__global_cache for f in dd.values() if f.size > field_a.size)
-        assert LazyDataset._LazyDataset__cache_size == cache_size
-        # cache field_b
-        dd.field_b[:]
-        # previous arrays should be discarded now
-        cache_size = dd.field_b.size
-        assert LazyDataset._LazyDataset__cache_size == cache_size
-        assert dd.field_b._LazyDataset__global_cache
-        assert all(~f._LazyDataset__global_cache for f in dd.values() if f.size < field_b.size)
-        assert all(f._data is None for f in dd.values() if f.size < field_b.size)
+        dd = FileBrowser(tmpf.name)
+        # browsing does not keep the file open
+        assert len(LazyDataset._files) == 0
+        assert FileBrowser(tmpf.name, lazy_groups=True).group.small[1] == 1.
+        assert len(LazyDataset._files) == 0
+        d.saveh5(tmpf.name, truncate_existing=True)
+        # the file is shared by all data sets and kept open
+        assert all(np.all(dd['field%d' % i][:] == d['field%d' % i]) for i in range(10))
+        assert dd.scalar[()] == 1. and np.all(dd.group.small[:] == d.group.small)
+        assert len(LazyDataset._files) == 1
+        fileobj = LazyDataset._files.open(h5py.File, tmpf.name)
+        assert dd.field0._dataset() is dd.field0._dataset()
+        # modified files are reopened
+        os.utime(tmpf.name, (0, 0))
+        assert np.all(dd.field0[:] == d.field0)
+        assert LazyDataset._files.open(h5py.File, tmpf.name) is not fileobj
+        LazyDataset.close_files(tmpf.name)
+        assert len(LazyDataset._files) == 0
+        assert np.all(dd.field1[:] == d.field1)
+
+
+def test_file_pool_threads():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        browsers = []
+        for i in range(4):
+            file_name = os.path.join(tmpdir, 'file%d.h5' % i)
+            with h5py.File(file_name, 'w') as fh:
+                fh.create_dataset('c', data=np.arange(20000.) + i, chunks=(500, ),
+                                  compression='gzip')
+            browsers.append(FileBrowser(file_name, lazy_max_size=10))
+        # files are evicted from the pool while other threads read them
+        LazyDataset.set_max_open_files(2)
+        errors = []
+
+        def read(thread):
+            for j in range(20):
+                i = (thread + j) % 4
+                start = 500 * j
+                try:
+                    assert np.all(browsers[i].c[start:start + 2000] ==
+                                  np.arange(start, start + 2000.) + i)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=read, args=(thread, )) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+    finally:
+        LazyDataset.set_max_open_files(128)
+        LazyDataset.close_files()
+        shutil.rmtree(tmpdir)
+
+
+def test_transpose_squeeze_partial_read():
+    data = np.random.rand(4, 1, 6, 5)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh.create_dataset('data', data=data)
+            fh.create_dataset('dims', data=data, chunks=(2, 1, 3, 5))
+
+        for squeeze, transpose in ((True, False), (False, True), (True, True)):
+            dd = FileBrowser(tmpf.name, squeeze=squeeze, transpose=transpose, lazy_max_size=0)
+            expected = data
+            if squeeze:
+                expected = np.squeeze(expected)
+            if transpose:
+                expected = np.transpose(expected)
+            for dataset in (dd.data, dd.dims):
+                assert dataset.shape == expected.shape
+                assert dataset.ndim == expected.ndim
+                for key in ((1, ), (slice(1, 3), Ellipsis, -1), (Ellipsis, slice(None, None, -2)),
+                            ([0, 2], 1)):
+                    assert np.all(dataset[key] == expected[key])
+                    assert dataset[key].shape == expected[key].shape
+                # only the selected hyperslab is read
+                block, _ = pydons.selection.hyperslab((1, ), dataset.shape)
+                assert pydons.selection.block_shape(dataset._disk_block(block)) == \
+                    tuple(1 if axis == dataset._axes[0] else n
+                          for axis, n in enumerate(data.shape))
+
+
+def test_iter_blocks():
+    data = np.random.rand(100, 6)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh.create_dataset('chunked', data=data, chunks=(8, 3), compression='gzip')
+            fh.create_dataset('contiguous', data=data)
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+
+        # aligned to the chunks
+        blocks = list(dd.chunked.iter_blocks(target_nbytes=20 * 6 * 8))
+        assert [block.shape[0] for block in blocks] == [16] * 6 + [4]
+        assert np.all(np.concatenate(blocks) == data)
+        blocks = list(dd.chunked.iter_blocks(axis=1, prefetch=False))
+        assert [block.shape for block in blocks] == [(100, 6)]
+        # contiguous data by the target size
+        blocks = list(dd.contiguous.iter_blocks(target_nbytes=30 * 6 * 8))
+        assert [block.shape[0] for block in blocks] == [30, 30, 30, 10]
+        blocks = list(dd.contiguous.iter_blocks(axis=-1, block_size=4))
+        assert np.all(np.concatenate(blocks, axis=1) == data)
+        assert dd.chunked._data is None
+        # iteration reads the data set block by block
+        assert np.all(np.array(list(dd.chunked)) == data)
+        assert dd.chunked._data is None
+
+        dd = FileBrowser(tmpf.name, transpose=True)
+        dd.chunked[:]
+        blocks = list(dd.chunked.iter_blocks(block_size=4))
+        assert np.all(np.concatenate(blocks) == data.T)
+
+
+def test_lazy_groups():
+    d = MatStruct()
+    d.field_a = np.random.rand(5)
+    d.group_b = MatStruct()
+    d.group_b.field_b = np.random.rand(3, 4)
+    d.group_b.group_c = MatStruct()
+    d.group_b.group_c.field_c = np.random.rand(7)
+    d.group_d = MatStruct()
+    d.group_d.field_d = np.arange(3)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        d.saveh5(tmpf.name)
+
+        dd = FileBrowser(tmpf.name, lazy_groups=True)
+
+        assert set(dd.keys()) == set(d.keys())
+        assert not dd.group_b._expanded
+        assert 'not loaded' in repr(dd.group_b)
+        # attribute access expands the group, sub-groups stay lazy
+        assert np.all(dd.group_b.field_b[:] == d.group_b.field_b)
+        assert dd.group_b._expanded
+        assert not dd.group_b.group_c._expanded
+        assert 'field_c' in dir(dd.group_b.group_c)
+        assert dd.group_b.group_c._expanded
+        assert np.all(dd.group_b.group_c.field_c[:] == d.group_b.group_c.field_c)
+        # iteration, len and item access
+        assert not dd.group_d._expanded
+        assert list(dd.group_d) == ['field_d']
+        dd2 = FileBrowser(tmpf.name, lazy_groups=True)
+        assert len(dd2.group_d) == 1
+        dd2 = FileBrowser(tmpf.name, lazy_groups=True)
+        assert np.all(dd2['group_d']['field_d'][:] == d.group_d.field_d)
+        assert isinstance(dd2.group_d, MatStruct)
+
+
+def test_metadata_index():
+    d = MatStruct()
+    d.field_a = np.arange(4.)
+    d.field_b = np.random.rand(30, 20)
+    d.group_c = MatStruct()
+    d.group_c.field_c = np.random.rand(50)
+
+    tmpdir = tempfile.mkdtemp()
+    file_name = os.path.join(tmpdir, 'data.h5')
+    d.saveh5(file_name)
+    with h5py.File(file_name, 'a') as fobj:
+        fobj['field_b'].attrs['units'] = 'm'
+    index_dir = os.path.join(tmpdir, 'index')
+
+    LazyDataset.close_files()
+    dd = FileBrowser(file_name, index=index_dir)
+    assert len(os.listdir(index_dir)) == 1
+    # the fresh index is used without opening the file
+    LazyDataset.close_files()
+    dd = FileBrowser(file_name, index=index_dir, transpose=True)
+    assert len(LazyDataset._files) == 0
+    assert dd.field_b.shape == (20, 30)
+    assert dd.field_b.attrs.units == 'm'
+    assert np.all(dd.field_a[:] == d.field_a)
+    assert len(LazyDataset._files) == 0
+    assert np.all(dd.field_b[:] == d.field_b.T)
+    assert np.all(dd.group_c.field_c[:] == d.group_c.field_c)
+    dd = FileBrowser(file_name, index=index_dir, lazy_groups=True)
+    assert not dd.group_c._expanded
+    assert np.all(dd.group_c.field_c[:] == d.group_c.field_c)
+    # a modified file is scanned again
+    LazyDataset.close_files()
+    with h5py.File(file_name, 'a') as fobj:
+        fobj['field_d'] = np.arange(100)
+    dd = FileBrowser(file_name, index=index_dir)
+    assert np.all(dd.field_d[:] == np.arange(100))
+    # only index files of the current user that others cannot modify are loaded
+    kind = 'h5py._hl.files.File'
+    assert pydons.metaindex.load(file_name, kind, index_dir) is not None
+    if hasattr(os, 'getuid'):
+        index_file = pydons.metaindex.index_paths(file_name, index_dir)[0]
+        os.chmod(index_file, 0o666)
+        assert pydons.metaindex.load(file_name, kind, index_dir) is None
+    # object references (dimension scales) are read from the file
+    LazyDataset.close_files()
+    with h5py.File(file_name, 'a') as fobj:
+        fobj['x'] = np.arange(4.)
+        fobj['x'].make_scale('x')
+        fobj['field_a'].dims[0].attach_scale(fobj['x'])
+        fobj['refs'] = np.array([fobj['x'].ref, fobj['field_a'].ref], dtype=h5py.ref_dtype)
+    dd = FileBrowser(file_name, index=index_dir)
+    assert pydons.metaindex.load(file_name, kind, index_dir) is not None
+    assert not any(name.endswith('.tmp') for name in os.listdir(index_dir))
+    dd = FileBrowser(file_name, index=index_dir)
+    assert 'DIMENSION_LIST' in dd.field_a.attrs
+    assert isinstance(dd.refs[0], h5py.Reference)
+    # index in the user cache directory
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+    try:
+        dd = FileBrowser(file_name, index=True)
+        assert os.listdir(os.path.join(tmpdir, 'cache', 'pydons'))
+        assert pydons.metaindex.load(file_name, kind) is not None
+        dd = FileBrowser(file_name, index=True)
+        assert sorted(dd.keys()) == ['field_a', 'field_b', 'field_d', 'group_c', 'refs', 'x']
+    finally:
+        if cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = cache_home
+    LazyDataset.close_files(file_name)
+    shutil.rmtree(tmpdir)
+
+
+def test_open_many():
+    tmpdir = tempfile.mkdtemp()
+    data = []
+    for i in range(3):
+        d = MatStruct()
+        d.shot = np.array([i])
+        d.group_a = MatStruct()
+        d.group_a.field_a = np.random.rand(20, 10)
+        d.saveh5(os.path.join(tmpdir, 'shot%d.h5' % i))
+        # object references cannot be sent by the workers
+        with h5py.File(os.path.join(tmpdir, 'shot%d.h5' % i), 'a') as fobj:
+            fobj['x'] = np.arange(20.)
+            fobj['x'].make_scale('x')
+            fobj['group_a/field_a'].dims[0].attach_scale(fobj['x'])
+            fobj['refs'] = np.array([fobj['x'].ref] * 11, dtype=h5py.ref_dtype)
+        data.append(d)
+
+    for processes in (2, None):
+        LazyDataset.close_files()
+        browsers = FileBrowser.open_many(os.path.join(tmpdir, 'shot*.h5'), processes=processes,
+                                         transpose=True)
+        assert len(browsers) == 3
+        # small data are sent by the workers, the files are not open yet
+        if processes:
+            assert len(LazyDataset._files) == 0
+        for i, (dd, d) in enumerate(zip(browsers, data)):
+            assert isinstance(dd, FileBrowser)
+            assert dd.shot[:] == [i]
+            assert dd.group_a.field_a.shape == (10, 20)
+            assert np.all(dd.group_a.field_a[:] == d.group_a.field_a.T)
+            assert 'DIMENSION_LIST' in dd.group_a.field_a.attrs
+            assert isinstance(dd.refs[0], h5py.Reference)
+    LazyDataset.close_files()
+    shutil.rmtree(tmpdir)
+
+
+def test_multi_file_browser():
+    tmpdir = tempfile.mkdtemp()
+    data = []
+    for i, n in enumerate((4, 6, 5)):
+        d = MatStruct()
+        d.time = np.arange(n) + 10. * i
+        d.group_a = MatStruct()
+        d.group_a.field_a = np.random.rand(n, 3)
+        d.group_a.field_b = np.random.rand(2, 3)
+        if i == 0:
+            d.only_first = np.arange(3)
+        d.saveh5(os.path.join(tmpdir, 'shot%d.h5' % i))
+        data.append(d)
+    pattern = os.path.join(tmpdir, 'shot*.h5')
+    time = np.concatenate([d.time for d in data])
+    field_a = np.concatenate([d.group_a.field_a for d in data])
+
+    mb = pydons.MultiFileBrowser(pattern, lazy_min_size=0)
+    assert 'only_first' not in mb
+    assert mb.time.shape == (15, )
+    assert mb.group_a.field_a.shape == (15, 3)
+    assert mb.group_a.field_b.shape == (6, 3)
+    with pydons.collect_stats() as counters:
+        # window spanning the first two files
+        assert np.all(mb.group_a.field_a[2:6, 1] == field_a[2:6, 1])
+    assert counters.reads == 2
+    assert np.all(mb.time[::-3] == time[::-3])
+    assert np.all(mb.time[[0, 14, 5]] == time[[0, 14, 5]])
+    assert np.all(mb.group_a.field_a[:] == field_a)
+    assert np.all(np.concatenate(list(mb.time.iter_blocks(block_size=4))) == time)
+
+    mb = pydons.MultiFileBrowser(pattern, axis=1, stack=True, processes=0, transpose=True)
+    assert 'time' not in mb
+    assert mb.group_a.field_b.shape == (3, 3, 2)
+    assert np.all(mb.group_a.field_b[:] ==
+                  np.stack([d.group_a.field_b.T for d in data], axis=1))
+    assert np.all(mb.group_a.field_b[1, 1:] ==
+                  np.stack([d.group_a.field_b.T for d in data], axis=1)[1, 1:])
+    LazyDataset.close_files()
+    shutil.rmtree(tmpdir)
+
+
+def test_path_index():
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh['diag/mag/coil_1'] = np.arange(20.)
+            fh['diag/mag/coil_12'] = np.arange(30.)
+            fh['diag/mag/count'] = np.arange(3)
+            # invalid keys are renamed
+            fh['diag/items/keys'] = np.arange(50)
+
+        for lazy_groups in (False, True):
+            dd = FileBrowser(tmpf.name, lazy_groups=lazy_groups)
+            assert dd['/diag/mag/coil_12'] is dd.diag.mag.coil_12
+            assert dd['/diag/items/keys'] is dd.diag['items_']['keys_']
+            assert dd['/diag/mag'] is dd.diag.mag
+            assert dd['/'] is dd
+            try:
+                dd['/diag/missing']
+                assert False
+            except KeyError:
+                pass
+
+            found = dd.find('*/coil_*')
+            assert list(found.keys()) == ['/diag/mag/coil_1', '/diag/mag/coil_12']
+            assert all(isinstance(dataset, LazyDataset) for dataset in found.values())
+            assert list(dd.find('coil_*', min_size=25).keys()) == ['/diag/mag/coil_12']
+            assert list(dd.find('/coil_*').keys()) == []
+            assert list(dd.find('*', dtype=np.integer).keys()) == ['/diag/items/keys',
+                                                                   '/diag/mag/count']
+            assert list(dd.find('^/diag/.*/c[a-z]+$', regex=True).keys()) == ['/diag/mag/count']
+
+
+def test_scan_filters():
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh['time'] = np.arange(5.)
+            fh['diag/mag/coil_1'] = np.arange(20.)
+            fh['diag/mag/flux'] = np.arange(20.)
+            fh['diag/magnet/coil_2'] = np.arange(20.)
+            fh['diag/raw/adc/channel'] = np.arange(20)
+            fh['raw/adc/channel'] = np.arange(20)
+
+        for lazy_groups in (False, True):
+            dd = FileBrowser(tmpf.name, exclude=['raw'], lazy_groups=lazy_groups)
+            assert sorted(dd.keys()) == ['diag', 'time']
+            assert sorted(dd.diag.keys()) == ['mag', 'magnet']
+
+            dd = FileBrowser(tmpf.name, include=['/diag/mag/coil_*', '/time'],
+                             lazy_groups=lazy_groups)
+            assert list(dd.find('*').keys()) == ['/diag/mag/coil_1', '/time']
+            assert list(dd.diag.keys()) == ['mag']
+
+            dd = FileBrowser(tmpf.name, include=['adc'], exclude=['/diag'],
+                             lazy_groups=lazy_groups)
+            assert list(dd.find('*').keys()) == ['/raw/adc/channel']
+
+            dd = FileBrowser(tmpf.name, max_depth=1, lazy_groups=lazy_groups)
+            assert list(dd.find('*').keys()) == ['/time']
+            assert list(dd.diag.keys()) == []
+
+    # groups excluded by the filter are not visited at all
+    visited = []
+    children = pydons._children
+
+    def _children(basegrp):
+        visited.append(basegrp.name)
+        return children(basegrp)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh['a/b/c'] = np.arange(20)
+            fh['raw/d/e'] = np.arange(20)
+        pydons._children = _children
+        try:
+            FileBrowser(tmpf.name, exclude=['/raw'])
+        finally:
+            pydons._children = children
+    assert visited == ['/', '/a', '/a/b']
+
+
+def test_read_many():
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            # written in the reverse order of the requests
+            fh.create_dataset('c', data=np.arange(100.), chunks=(10, ))
+            fh['b/x'] = np.arange(50)
+            fh['a'] = np.arange(30.)
+            fh.create_dataset('empty', shape=(10, ), chunks=(5, ), dtype='f8')
+
+        dd = FileBrowser(tmpf.name)
+        offsets = [pydons._read_offset(dd[path]) for path in ('/a', '/b/x', '/c')]
+        assert offsets[0] > offsets[1] > offsets[2]
+        assert pydons._read_offset(dd.c, slice(35, 40)) > offsets[2]
+        assert pydons._read_offset(dd.empty) is None
+
+        read = []
+
+        def hook(event, **info):
+            if event == 'read':
+                read.append(info['path'])
+
+        pydons.instrument.add_hook(hook)
+        try:
+            res = dd.read_many({'/a': slice(2, 5), 'b/x': None, dd.c: (slice(35, 40), ),
+                                '/empty': 0})
+        finally:
+            pydons.instrument.remove_hook(hook)
+        assert list(res.keys()) == ['/a', 'b/x', '/c', '/empty']
+        assert np.all(res['/a'] == np.arange(2., 5.))
+        assert np.all(res['b/x'] == np.arange(50))
+        assert np.all(res['/c'] == np.arange(35., 40.))
+        # ordered by the file offset
+        assert read[:3] == ['/c', '/b/x', '/a']
+
+        res = dd.read_many(['/a', '/c'])
+        assert np.all(res['/c'] == np.arange(100.))
@@ -1,8 +1,9 @@
-from pydons import MatStruct, FileBrowser, LazyDataset
+from pydons import MatStruct, FileBrowser, LazyDataset, MultiFileBrowser
 import netCDF4
 import numpy as np
 import tempfile
 import os
+import shutil
 
 
 DATADIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -26,3 +27,144 @@ def test_netcdf4():
         assert 'mygroup' in dd
         assert 'var1' in dd.mygroup
         assert np.all(dd.mygroup.var1[:] == data1)
+
+
+def test_netcdf4_chunks():
+    data = np.random.rand(50, 8)
+
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        fh.createDimension('t', None)
+        fh.createDimension('x', 8)
+        var = fh.createVariable('signal', data.dtype.str, ('t', 'x'), chunksizes=(10, 4), zlib=True)
+        var[:] = data
+        fh.close()
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+
+        assert dd.signal._chunks == (10, 4)
+        assert np.all(dd.signal[5:25, 3] == data[5:25, 3])
+        assert np.all(dd.signal[::-4, 1:6] == data[::-4, 1:6])
+        info = LazyDataset.cache_info()
+        assert np.all(dd.signal[12:18, 2:3] == data[12:18, 2:3])
+        assert LazyDataset.cache_info().misses == info.misses
+
+
+def test_netcdf4_chunks_fill_value():
+    data = np.ma.masked_array(np.arange(40.), mask=np.arange(40) % 3 == 0)
+
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        fh.createDimension('t', None)
+        var = fh.createVariable('signal', 'f8', ('t', ), fill_value=-1., chunksizes=(8, ))
+        var[:] = data
+        fh.close()
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+        part = dd.signal[5:25]
+        assert part.fill_value == -1.
+        assert np.all(part.filled() == data[5:25].filled(-1.))
+        LazyDataset.close_files(tmpf.name)
+
+
+def test_netcdf4_attrs():
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        fh.createDimension('x', 3)
+        var = fh.createVariable('var', 'f8', ('x', ))
+        var[:] = np.arange(3)
+        var.units = 'm'
+        var.factor = 2.
+        fh.close()
+
+        dd = FileBrowser(tmpf.name)
+
+        assert isinstance(dd.var.attrs, MatStruct)
+        assert list(dd.var.attrs.keys()) == ['units', 'factor']
+        assert dd.var.attrs.factor == 2.
+        LazyDataset.close_files(tmpf.name)
+
+
+def test_nc4file_getitem():
+    from pydons import NC4File
+
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        grp = fh.createGroup('a').createGroup('b')
+        grp.createDimension('x', 3)
+        grp.createVariable('var', 'f8', ('x', ))[:] = np.arange(3)
+        fh.close()
+
+        fh = NC4File(tmpf.name, 'r')
+        var = fh['/a/b/var']
+        assert var is fh['/a/b/var']
+        assert fh['a/b'] is var.group()
+        assert fh['/'] is fh
+        assert np.all(var[:] == np.arange(3))
+        fh.close()
+        assert fh._items == {}
+        assert list(fh.__dict__.keys()) == ['_items']
+
+
+def test_netcdf4_diff_masked():
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        fh.createDimension('t', None)
+        var = fh.createVariable('signal', 'f8', ('t', ), fill_value=-999.)
+        var[:] = np.ma.masked_array(np.arange(50.), mask=np.arange(50) % 7 == 0)
+        fh.close()
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=10)
+        assert isinstance(dd.signal[:], np.ma.MaskedArray)
+
+        # values masked in both are equal
+        for nan in ('propagate', 'equal', 'ignore'):
+            ddiff = dd.diff(dd, nan=nan, block_nbytes=80)
+            assert ddiff.signal == 0
+            assert ddiff.diff_norm == 0
+        # a value masked in one of them only is a difference
+        other = MatStruct([('signal', np.arange(50.))])
+        assert dd.diff(other, nan='ignore').signal == np.inf
+        LazyDataset.close_files(tmpf.name)
+
+
+def test_netcdf4_vlen_str():
+    with tempfile.NamedTemporaryFile(suffix=".nc") as tmpf:
+        fh = netCDF4.Dataset(tmpf.name, mode='w')
+        fh.createDimension('x', None)
+        var = fh.createVariable('s', str, ('x', ))
+        for i, value in enumerate(('hello', 'world', 'again')):
+            var[i] = value
+        fh.close()
+
+        dd = FileBrowser(tmpf.name, lazy_max_size=2)
+        assert dd.s._chunks is not None
+        assert list(dd.s[0:2]) == ['hello', 'world']
+        assert list(dd.s[::2]) == ['hello', 'again']
+        assert list(dd.s) == ['hello', 'world', 'again']
+        assert [list(block) for block in dd.s.iter_blocks(block_size=2)] == \
+            [['hello', 'world'], ['again']]
+        LazyDataset.close_files(tmpf.name)
+
+
+def test_netcdf4_multi_file_packed():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        data = []
+        for i in range(3):
+            values = np.arange(5) * 0.37 + i
+            fh = netCDF4.Dataset(os.path.join(tmpdir, 'part%d.nc' % i), mode='w')
+            fh.createDimension('t', None)
+            var = fh.createVariable('v', 'i2', ('t', ))
+            var.scale_factor = 0.01
+            var.add_offset = 0.
+            var[:] = values
+            fh.close()
+            data.append(np.round(values, 2))
+
+        mb = MultiFileBrowser(os.path.join(tmpdir, 'part*.nc'), lazy_max_size=0)
+        assert np.allclose(mb.v[:], np.concatenate(data))
+        assert np.allclose(mb.v[3:8], np.concatenate(data)[3:8])
+        LazyDataset.close_files()
+    finally:
+        shutil.rmtree(tmpdir)
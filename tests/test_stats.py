@@ -0,0 +1,45 @@
+import pydons
+from pydons import MatStruct, FileBrowser, LazyDataset
+import pydons.instrument
+import numpy as np
+import tempfile
+import h5py
+
+
+def test_stats():
+    data = np.random.rand(100, 10)
+
+    with tempfile.NamedTemporaryFile(suffix=".h5") as tmpf:
+        with h5py.File(tmpf.name, 'w') as fh:
+            fh.create_dataset('contiguous', data=data)
+            fh.create_dataset('chunked', data=data, chunks=(10, 10))
+
+        dd = FileBrowser(tmpf.name)
+        events = []
+
+        def hook(event, **info):
+            events.append(event)
+
+        pydons.instrument.add_hook(hook)
+        try:
+            with pydons.collect_stats() as counters:
+                dd.contiguous[:]
+                dd.contiguous[:]
+                dd.chunked[5:25]
+        finally:
+            pydons.instrument.remove_hook(hook)
+
+        res = pydons.stats(counters)
+        assert res.reads == 4
+        assert res.read_bytes == data.nbytes + 3 * data[:10].nbytes
+        assert res.hits == 1
+        # first whole array lookups of both data sets and three chunks
+        assert res.misses == 5
+        assert res.cache_nbytes == LazyDataset.cache_info().nbytes
+        item = res.datasets['%s:/contiguous' % dd.contiguous._filepath]
+        assert item.reads == 1
+        assert item.read_bytes == data.nbytes
+        assert item.max_read_time <= item.read_time
+        assert events.count('read') == 4
+        # global counters include the scoped ones
+        assert pydons.stats().reads >= res.reads
@@ -1,4 +1,4 @@
-from pydons import MatStruct, loadmat, loadh5, load
+from pydons import MatStruct, MatStructArray, loadmat, loadh5, load
 import numpy as np
 import tempfile
 from pydons import _OrderedDict as OrderedDict
@@ -109,3 +109,33 @@ def test_dedict_h5():
         ms2 = MatStruct.loadh5(tmpf.name)
     assert isinstance(ms2['z'], OrderedDict)
     assert ms.diff(ms2).diff_max == 0
+
+
+def test_struct_array_storage():
+    arr = MatStructArray.from_structs([MatStruct([('x', float(i)), ('name', 'n%d' % i),
+                                                  ('v', np.arange(i + 1.))])
+                                       for i in range(3)])
+    d = MatStruct()
+    d.arr = arr
+    d.y = np.random.rand(3)
+
+    for suffix, save, load_func in ((".mat", d.savemat, MatStruct.loadmat),
+                                    (".h5", d.saveh5, MatStruct.loadh5)):
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmpf:
+            save(tmpf.name)
+            dd = load_func(tmpf.name)
+
+            assert isinstance(dd.arr, MatStructArray)
+            assert dd.arr.fields == arr.fields
+            assert np.all(dd.arr.x == arr.x)
+            assert dd.arr.x.dtype == arr.x.dtype
+            assert list(dd.arr.name) == list(arr.name)
+            # ragged field
+            for v, vv in zip(dd.arr.v, arr.v):
+                assert np.all(v == vv)
+
+    with tempfile.NamedTemporaryFile(suffix=".mat") as tmpf:
+        arr.savemat(tmpf.name)
+        aa = MatStructArray.loadmat(tmpf.name)
+        assert isinstance(aa, MatStructArray)
+        assert np.all(aa.x == arr.x)